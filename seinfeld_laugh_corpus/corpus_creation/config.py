@@ -3,6 +3,35 @@ import os
 FFMPEG_PATH = os.path.join("external_tools", "ffmpeg", "bin")
 SOX_PATH = os.path.join("external_tools", "sox")
 
+# 'full' extracts the audio at the video's sample rate. 'reduced' low-passes & resamples it to a rate that is just
+# enough for the dB envelopes that the rest of the pipeline uses (see envelope.get_reduced_sample_rate()). 'reduced' is
+# opt-in: episodes near the laugh track & subtitle sync thresholds may be judged differently by it (see
+# tests/test_audio_profiles.py).
+AUDIO_PROFILE = 'full'
+
+# the show whose episodes are processed: 'seinfeld', 'friends' or 'bbt' (Big Bang Theory).
+SHOW_NAME = 'bbt'
+
 # you must have a valid Opensubtitles User-Agent for subtitle downloading to work!
 opensubtitles_credentials = {'user': 'user', 'password': 'password'}
 
+# downloaded subtitles (by their opensubtitles file ID) & search results are kept here, so rebuilds can run offline.
+SUBTITLES_CACHE_PATH = os.path.join("cache", "subtitles")
+
+# downloaded screenplay pages are kept here. In offline mode, screenplays are only read from this cache.
+SCREENPLAYS_CACHE_PATH = os.path.join("cache", "screenplays")
+OFFLINE_MODE = False
+# seconds for which a cached page (or a page that wasn't found) is used without asking the server again, e.g. from the
+# prefetch of create_corpus until the episodes are processed.
+SCREENPLAYS_FRESHNESS = 24 * 60 * 60
+
+# the tokens of parsed screenplays (by a hash of the screenplay and of the tokenizer's settings & code), so re-running
+# the parser after changing its rules doesn't tokenize the screenplays again.
+SCREENPLAY_TOKENS_CACHE_PATH = os.path.join("cache", "screenplay_tokens")
+
+# the outputs of the processing stages of the episodes (see Processor), so re-runs only run the stages whose inputs or
+# code changed.
+STAGES_CACHE_PATH = os.path.join("cache", "stages")
+
+# the output of every episode's processing (see create_corpus) is written to a log file here.
+CORPUS_LOGS_PATH = "logs"
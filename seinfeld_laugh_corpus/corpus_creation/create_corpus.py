@@ -1,34 +1,389 @@
 """
 A module that creates the annotated Seinfeld corpus from scratch, given the episodes in .mkv format.
+
+Several episodes are processed at once. By default they're processed by long-lived worker processes (see
+episode_worker), which import the processing code once instead of once per episode. A worker that crashes is replaced,
+and only the episode it was processing fails. Alternatively, every episode is processed by a new worker process.
+
+A new episode is only started when there's
+enough available memory & free disk space for it: the peak memory & temporary disk footprint of every processing stage
+is measured while the episodes run, and a new episode is assumed to need the largest of them (until an episode has
+been processed successfully, at least DEFAULT_EPISODE_MEMORY & DEFAULT_EPISODE_DISK are assumed). Episodes that are
+already running are assumed to grow up to that footprint as well.
+
+Before the episodes are processed, their screenplays are prefetched concurrently into the cache (see
+screenplay_downloader.prefetch), so the episodes don't wait for the network.
 """
 
 # python imports
 import argparse
 import os
+import re
 import subprocess
+import sys
+import threading
+from time import sleep
+from timeit import default_timer as timer
 
 import psutil
 
+from config import CORPUS_LOGS_PATH, SHOW_NAME
+from episode_worker import READY, DONE
+from screenplay_downloader import http_client, prefetch
+
+DEFAULT_EPISODE_MEMORY = 2 * 2**30      # bytes, assumed until the stages' memory footprints are measured.
+DEFAULT_EPISODE_DISK = 3 * 2**30        # bytes of temporary files, assumed until the stages' footprints are measured.
+MEMORY_RESERVE = 2**30                  # bytes of memory that are left for the rest of the system.
+DISK_RESERVE = 2**30
+POLL_INTERVAL = 1                       # seconds between measurements.
+REPORT_INTERVAL = 30                    # seconds between progress reports.
+MAX_EPISODES_PER_WORKER = 20            # a long-lived worker is replaced after this many episodes (e.g. memory leaks).
+
+# the processor announces every stage with a line such as "Extracting audio..." or "Processing 'S01E01.mkv'...".
+STAGE_LINE = re.compile(r"^([A-Z][A-Za-z &,()]*?)(?: '.*')?\.\.\.$")
 
-# internal imports
+# the rest of the names of an episode's temporary files (see Processor) after the video's base name, e.g. '_laugh.wav'.
+# The envelopes of .wav files are named after their fingerprints, and the files may be snapshots of a stage's outputs
+# (.unsaved) or still being written (.tmp).
+TEMP_FILE_SUFFIX = re.compile(r"(_norm|_laugh)?(\.[0-9a-f]{16})?\.(wav|laugh|srt|screenplay|formatted|envelope\.npz)"
+                              r"(\.unsaved)?(\.\d+\.\d+\.tmp)?$")
 
 
-def run(episodes_path):
+def run(episodes_path, jobs=None, long_lived_workers=True, prefetch_screenplays=True, keep_merge_inputs=False):
+    episodes = []
     for dirpath, _, filenames in os.walk(episodes_path):
-        for filename in filenames:
+        for filename in sorted(filenames):
             if filename.endswith(".mkv"):
-                print(psutil.virtual_memory())
-                file_path = os.path.join(dirpath, filename)
-                subprocess.call(['python', 'processor.py', file_path])
+                episodes.append(os.path.join(dirpath, filename))
+
+    if prefetch_screenplays and not http_client.offline:
+        prefetch.run(SHOW_NAME, directory=episodes_path)
+
+    scheduler = Scheduler(jobs or os.cpu_count(), long_lived_workers, keep_merge_inputs)
+    scheduler.run(episodes)
+
+
+class Job:
+    """
+    An episode that is being processed.
+    """
+    def __init__(self, file_path, log):
+        self.file_path = file_path
+        self.base_path = file_path.rsplit(".", 1)[0]
+        self.log = log
+        self.stage = None
+        self.succeeded = False
+        self.finished = False
+        self.memory = 0         # bytes, the last measurement
+        self.disk = 0
+        self.start_time = timer()
+
+    def write(self, line):
+        self.log.write(line)
+        line = line.rstrip()
+        match = STAGE_LINE.match(line)
+        if match:
+            self.stage = match.group(1)
+        elif line.startswith("SUCCESS for"):
+            self.succeeded = True
+
+    def finish(self):
+        self.log.close()
+        self.finished = True
+
+    def measure(self, pid):
+        """
+        Measures the memory of the episode's processes (the one that processes it and the tools it runs, e.g. ffmpeg),
+        and the size of its temporary files (which are named after the video file, see TEMP_FILE_SUFFIX).
+        """
+        try:
+            processes = [psutil.Process(pid)]
+            processes += processes[0].children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        memory = 0
+        for process in processes:
+            try:
+                memory += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.memory = memory
+
+        disk = 0
+        directory, name = os.path.split(self.base_path)
+        for entry in os.scandir(directory or '.'):
+            # e.g. 'S01E01-02.wav' isn't a file of 'S01E01'.
+            if entry.name.startswith(name) and TEMP_FILE_SUFFIX.match(entry.name, len(name)):
+                try:
+                    disk += entry.stat().st_size
+                except OSError:
+                    pass    # removed in the meantime
+        self.disk = disk
+
+
+class Worker:
+    """
+    An episode_worker.py process: either a long-lived one, or one that only processes a single episode.
+    """
+    def __init__(self, long_lived, processes, keep_merge_inputs=False):
+        """
+        :param processes: The number of processes that the processing of an episode may use.
+        :param keep_merge_inputs: Keep the inputs of the episodes' merges (see Processor).
+        """
+        self.long_lived = long_lived
+        self.job = None
+        self.episodes = 0
+        self.crashed = False
+        self.startup_time = None    # seconds from starting the process until it was ready to process an episode
+        self.spawn_time = timer()
+        args = [sys.executable, '-u', 'episode_worker.py', '--processes', str(processes)]
+        if keep_merge_inputs:
+            args.append('--keep-merge-inputs')
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True, errors='replace')
+        self.reader = threading.Thread(target=self._read_output, daemon=True)
+        self.reader.start()
+
+    def assign(self, job):
+        """
+        :return: True if the episode was assigned, False if the worker has exited (it's marked as crashed, and the job
+                 is finished).
+        """
+        self.job = job
+        self.episodes += 1
+        try:
+            self.process.stdin.write(job.file_path + '\n')
+            self.process.stdin.flush()
+        except OSError:     # e.g. BrokenPipeError
+            # the reader may finish the job as well, once it sees that the process has exited.
+            self.reader.join()
+            self.crashed = True
+            self.job = None
+            if not job.finished:
+                job.finish()
+            return False
+        return True
+
+    def retire(self):
+        """
+        Lets the worker exit once it's done with its current episode.
+        """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass    # the worker has already exited
+
+    def is_idle(self):
+        return self.long_lived and self.job is None and not self.process.stdin.closed and self.is_alive()
+
+    def is_alive(self):
+        return self.process.poll() is None or self.reader.is_alive()
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            if line.rstrip() == READY:
+                self.startup_time = timer() - self.spawn_time
+            elif line.rstrip() == DONE:
+                # the worker is idle before the job is finished, so the scheduler never sees it as still busy.
+                job, self.job = self.job, None
+                job.finish()
+            elif self.job:
+                self.job.write(line)
+        self.process.wait()
+        if self.job:
+            self.crashed = self.long_lived
+            job, self.job = self.job, None
+            job.finish()
+
+
+class Scheduler:
+    def __init__(self, jobs, long_lived_workers=True, keep_merge_inputs=False):
+        """
+        :param jobs: The maximal number of episodes that are processed at once.
+        :param long_lived_workers: Process the episodes by long-lived worker processes, instead of by a new process
+                                   per episode.
+        :param keep_merge_inputs: Keep the inputs of the episodes' merges (see Processor).
+        """
+        if jobs < 1:
+            raise Exception("The number of jobs must be at least 1 (got %d)." % jobs)
+        self.jobs = jobs
+        # the episodes share the CPUs, so the merge of a double episode doesn't start a process per CPU.
+        self.processes_per_episode = max(1, (os.cpu_count() or 1) // jobs)
+        self.long_lived_workers = long_lived_workers
+        self.keep_merge_inputs = keep_merge_inputs
+        self.workers = []
+        self.running = []       # Job objects
+        # the peak footprint of every stage, e.g. {'memory': {'Extracting audio': 2**28, ...}, 'disk': {...}}
+        self.peaks = {'memory': {}, 'disk': {}}
+        self.done, self.failed = [], []
+        self.startup_times = []     # of the workers (see Worker.startup_time)
+
+    def run(self, episodes):
+        pending = [e for e in episodes if not os.path.isfile(e.rsplit(".", 1)[0] + '.merged')]
+        print("%d episodes to process (%d already processed), up to %d at once."
+              % (len(pending), len(episodes) - len(pending), self.jobs))
+        start_time = last_report = timer()
+        while pending or self.running:
+            self._measure()
+            self._reap()
+            while pending and len(self.running) < self.jobs and self._can_start(pending[0]):
+                self._start(pending.pop(0))
+            if timer() - last_report >= REPORT_INTERVAL:
+                self._report(len(pending), timer() - start_time)
+                last_report = timer()
+            sleep(POLL_INTERVAL)
+
+        for worker in self.workers:
+            if worker.long_lived:
+                worker.retire()
+            worker.process.wait()
+            worker.reader.join()
+        self._reap()
+        print("Done in %s. %d episodes succeeded, %d failed." %
+              (_format_duration(timer() - start_time), len(self.done) - len(self.failed), len(self.failed)))
+        self._report_startup_times()
+        for file_path in self.failed:
+            print("FAILED: '%s'" % file_path)
+
+    def _start(self, file_path):
+        job = self._create_job(file_path)
+        if self.long_lived_workers:
+            worker = next((w for w in self.workers if w.is_idle()), None)
+            if worker is not None and not worker.assign(job):
+                print("A worker exited before it got '%s', it will be replaced." % os.path.basename(file_path))
+                job, worker = self._create_job(file_path), None
+            if worker is None:
+                worker = Worker(long_lived=True, processes=self.processes_per_episode,
+                                keep_merge_inputs=self.keep_merge_inputs)
+                self.workers.append(worker)
+                worker.assign(job)
+            if worker.episodes >= MAX_EPISODES_PER_WORKER:
+                worker.retire()
+        else:
+            worker = Worker(long_lived=False, processes=self.processes_per_episode,
+                            keep_merge_inputs=self.keep_merge_inputs)
+            self.workers.append(worker)
+            worker.assign(job)
+            worker.retire()
+        self.running.append(job)
+        print("Started '%s' (log: '%s')." % (os.path.basename(file_path), job.log.name))
+
+    @staticmethod
+    def _create_job(file_path):
+        os.makedirs(CORPUS_LOGS_PATH, exist_ok=True)
+        log_path = os.path.join(CORPUS_LOGS_PATH, os.path.basename(file_path).rsplit(".", 1)[0] + '.log')
+        return Job(file_path, open(log_path, 'w', encoding='utf-8'))
+
+    def _reap(self):
+        for job in [job for job in self.running if job.finished]:
+            self.running.remove(job)
+            self.done.append(job.file_path)
+            if not job.succeeded:
+                self.failed.append(job.file_path)
+            print("%s '%s' in %s." % ("Finished" if job.succeeded else "FAILED", os.path.basename(job.file_path),
+                                      _format_duration(timer() - job.start_time)))
+        for worker in [worker for worker in self.workers if not worker.is_alive()]:
+            self.workers.remove(worker)
+            if worker.startup_time is not None:
+                self.startup_times.append((worker.startup_time, worker.episodes if worker.long_lived else 1))
+            if worker.crashed:
+                print("A worker crashed (exit code: %d), it will be replaced." % worker.process.returncode)
+
+    def _measure(self):
+        for worker in self.workers:
+            job = worker.job
+            if job is None:
+                continue
+            job.measure(worker.process.pid)
+            if job.stage:
+                for resource in ('memory', 'disk'):
+                    peaks = self.peaks[resource]
+                    peaks[job.stage] = max(peaks.get(job.stage, 0), getattr(job, resource))
+
+    def _get_episode_footprint(self, resource):
+        """
+        :param resource: 'memory' or 'disk'.
+        :return: The number of bytes an episode is assumed to need at its peak.
+        """
+        measured = max(self.peaks[resource].values(), default=0)
+        if len(self.done) > len(self.failed):
+            return measured
+        # until an episode has gone through all of the stages, the later stages may need more than what was measured.
+        return max(measured, DEFAULT_EPISODE_MEMORY if resource == 'memory' else DEFAULT_EPISODE_DISK)
+
+    def _can_start(self, file_path):
+        """
+        :return: True if there's enough memory & disk space to start processing the episode.
+        """
+        if not self.running:
+            return True     # always make progress, even if the footprint was overestimated
+        memory, disk = self._get_episode_footprint('memory'), self._get_episode_footprint('disk')
+        # the running episodes may still grow up to their peak
+        available_memory = psutil.virtual_memory().available - sum(max(0, memory - job.memory) for job in self.running)
+        free_disk = psutil.disk_usage(os.path.dirname(file_path) or '.').free - \
+            sum(max(0, disk - job.disk) for job in self.running)
+        return available_memory >= memory + MEMORY_RESERVE and free_disk >= disk + DISK_RESERVE
+
+    def _report(self, pending, elapsed):
+        finished = len(self.done)
+        total = finished + len(self.running) + pending
+        if finished:
+            eta = _format_duration(elapsed / finished * (total - finished))
+        else:
+            eta = "unknown"
+        print("Progress: %d/%d episodes done (%d failed), %d running, %d pending. Elapsed: %s, ETA: %s. "
+              "Episode footprint: %.1f GB memory, %.1f GB disk. Available memory: %.1f GB."
+              % (finished, total, len(self.failed), len(self.running), pending, _format_duration(elapsed), eta,
+                 self._get_episode_footprint('memory') / 2**30, self._get_episode_footprint('disk') / 2**30,
+                 psutil.virtual_memory().available / 2**30))
+        for job in self.running:
+            print("    '%s': %s (%.1f GB memory, %.1f GB disk)" % (os.path.basename(job.file_path), job.stage,
+                                                                  job.memory / 2**30, job.disk / 2**30))
+
+    def _report_startup_times(self):
+        """
+        Reports how long it took to start the workers (mostly importing the processing code), and how much of it was
+        saved by reusing them for several episodes.
+        """
+        if not self.startup_times:
+            return
+        workers = len(self.startup_times)
+        episodes = sum(n for _, n in self.startup_times)
+        average = sum(t for t, _ in self.startup_times) / workers
+        if self.long_lived_workers:
+            print("Started %d workers for %d episodes, in %.1f seconds on average. Compared to starting a new process "
+                  "per episode, this saved %.1f seconds per episode (%s in total)."
+                  % (workers, episodes, average, average * (episodes - workers) / max(episodes, 1),
+                     _format_duration(average * (episodes - workers))))
+        else:
+            print("Starting a new process per episode took %.1f seconds on average (%s in total). Long-lived workers "
+                  "would only start once per worker." % (average, _format_duration(average * workers)))
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="A script to create the Seinfeld corpus from scratch.")
     parser.add_argument('episodes_path', help='A folder that contains all of the Seinfeld episodes in .mkv format.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help="The maximal number of episodes that are processed at once (default: the number of CPUs).")
+    parser.add_argument('--process-per-episode', action='store_true',
+                        help="Process every episode by a new process, instead of by long-lived worker processes.")
+    parser.add_argument('--no-prefetch', action='store_true',
+                        help="Don't prefetch the screenplays of the episodes before processing them.")
+    parser.add_argument('--keep-merge-inputs', action='store_true',
+                        help="Keep the .formatted, .srt & .laugh files of the episodes, so they can be merged again by "
+                             "data_merger/batch_merger.py.")
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
     episodes_path = args.episodes_path
 
     if not os.path.exists(episodes_path):
         print("'%s' illegal path!\n" % episodes_path)
 
-    run(episodes_path)
+    run(episodes_path, args.jobs, not args.process_per_episode, not args.no_prefetch, args.keep_merge_inputs)
@@ -0,0 +1,113 @@
+"""
+Merges a whole directory of episodes on a pool of worker processes.
+
+For every episode, the directory must contain EPISODE.formatted (screenplay), EPISODE.srt (subtitles) and
+EPISODE_laugh.laugh or EPISODE.laugh (laugh times). processor.py deletes them once the episode is merged, unless it's
+run with --keep-merge-inputs (so is create_corpus.py). The output of each episode is written to EPISODE.merged.
+"""
+import argparse
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from timeit import default_timer as timer
+
+from data_merger import data_merger
+
+Episode = namedtuple('Episode', ["name", "screenplay", "srt", "laugh_track", "output"])
+
+
+def run(directory, processes=None, overwrite=False, window=data_merger.WINDOW,
+        laugh_times_margin=data_merger.laugh_times_margin):
+    episodes = find_episodes(directory)
+    if not overwrite:
+        episodes = [episode for episode in episodes if not os.path.exists(episode.output)]
+    if not episodes:
+        print("No episodes to merge in '%s'." % directory)
+        return
+
+    print("Merging %d episodes..." % len(episodes))
+    start = timer()
+    timings, failures = [], []
+    with ProcessPoolExecutor(processes) as executor:
+        futures = {executor.submit(merge_episode, episode, window, laugh_times_margin): episode
+                   for episode in episodes}
+        for future in as_completed(futures):
+            episode = futures[future]
+            try:
+                seconds = future.result()
+            except Exception as e:
+                print("ERROR merging '%s': %s" % (episode.name, str(e)))
+                failures.append(episode)
+            else:
+                print("Merged '%s' (%.1f seconds)." % (episode.name, seconds))
+                timings.append((seconds, episode.name))
+
+    print_summary(timings, failures, timer() - start)
+
+
+def find_episodes(directory):
+    """
+    :param directory: A directory with .formatted, .srt and .laugh files.
+    :return: A list of Episode objects, for every episode that has all 3 files.
+    """
+    result = []
+    filenames = set(os.listdir(directory))
+    for filename in sorted(filenames):
+        if not filename.endswith('.formatted'):
+            continue
+        name = filename.rsplit('.', 1)[0]
+        srt = name + '.srt'
+        laugh_track = next((f for f in (name + '_laugh.laugh', name + '.laugh') if f in filenames), None)
+        if srt not in filenames or not laugh_track:
+            print("Skipping '%s' - missing subtitles or laugh times." % name)
+            continue
+        result.append(Episode(name=name,
+                              screenplay=os.path.join(directory, filename),
+                              srt=os.path.join(directory, srt),
+                              laugh_track=os.path.join(directory, laugh_track),
+                              output=os.path.join(directory, name + '.merged')))
+    return result
+
+
+def merge_episode(episode, window, laugh_times_margin):
+    """
+    Merges one episode (runs in a worker process).
+    :return: The time it took, in seconds.
+    """
+    start = timer()
+    # double episodes are aligned in segments, in this process (the pool already keeps all of the CPUs busy).
+    is_double_episode = bool(re.search(r'E\d+E\d+', episode.name))
+    data_merger.run(episode.screenplay, episode.srt, episode.laugh_track, episode.output,
+                    anchored=is_double_episode, processes=1, window=window, laugh_times_margin=laugh_times_margin)
+    return timer() - start
+
+
+def print_summary(timings, failures, total_seconds, slowest=5):
+    print("\nMerged %d episodes in %.1f seconds (%.2f episodes/min). %d failed." %
+          (len(timings), total_seconds, 60 * len(timings) / total_seconds, len(failures)))
+    if timings:
+        print("Slowest episodes:")
+        for seconds, name in sorted(timings, reverse=True)[:slowest]:
+            print("    %.1f seconds - '%s'" % (seconds, name))
+    for episode in failures:
+        print("FAILED: '%s'" % episode.name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge the subtitles, laughter cues & screenplays of a whole "
+                                                 "directory of episodes.")
+    parser.add_argument('directory', help="A folder with .formatted, .srt and .laugh files, as kept by processor.py "
+                                          "--keep-merge-inputs.")
+    parser.add_argument('--processes', type=int, help="Number of worker processes (default: number of CPUs).")
+    parser.add_argument('--overwrite', action='store_true', help="Re-merge episodes that already have a .merged file.")
+    parser.add_argument('--window', type=int, default=data_merger.WINDOW,
+                        help="Maximum amount of subtitles (exclusive) that can be matched with a dialog line.")
+    parser.add_argument('--margin', type=float, default=data_merger.laugh_times_margin,
+                        help="The estimated time (in seconds) it takes the audience to laugh after a joke.")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print("'%s' illegal path!\n" % args.directory)
+    else:
+        run(args.directory, args.processes, args.overwrite, args.window, args.margin)
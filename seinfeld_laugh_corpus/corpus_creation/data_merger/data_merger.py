@@ -17,74 +17,114 @@ import argparse
 import os
 import re
 import sys
-from collections import defaultdict
+from array import array
+from bisect import bisect_left
+from collections import Counter
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer as timer
 
-import pysrt
+from utils import srt_reader
 
 Subtitle = namedtuple('Subtitle', ["txt", "start", "end"])   # text (dialog), start (in seconds), end (in seconds)
 Result = namedtuple('Result', ["k", "score"])   # an object that contains the result of the calculations from
                                                 # the dynamic programming algorithm
+AlignmentStats = namedtuple('AlignmentStats', ["cells", "peak_memory"])     # cells evaluated, table size in bytes
 laugh_times_margin = 0.6    # the estimated time it takes the audience to laugh after a joke is delivered
 
+popcount = getattr(int, 'bit_count', lambda bits: bin(bits).count('1'))
 
-def run(screenplay_path, srt_path, laugh_track_path, output_path):
-    global match
-    match = defaultdict(dict)
-    match[tuple()] = defaultdict(lambda: Result(k=0, score=0))
+COMMERCIAL = re.compile(r'\w{3,20}\.\w{2,20}')    # e.g. a URL of a subtitles website
+TAG = re.compile(r'</?..?>')                    # e.g. <i>
+SPEAKER_DASH = re.compile('(?:^-)|(?:\n-)')
+SPEAKER_NAME = re.compile(r'\w{3,10}:')
 
-    aligned_subs = merge(screenplay_path, srt_path)
+WRITE_BUFFER_SIZE = 2**20   # in bytes
+
+# A limit for the amount of subtitles that can fit a line of dialog.
+# (Without a reasonable pruning window, calculation becomes too slow.)
+WINDOW = 16
+
+MIN_ANCHOR_WORDS = 5            # a dialog line must have at least this many words to serve as an anchor.
+MAX_SEGMENT_FRACTION = 0.5      # if a segment between anchors is bigger than this fraction of the dialog, the anchors
+                                # are too sparse and the full alignment is used instead.
+
+
+def run(screenplay_path, srt_path, laugh_track_path, output_path, anchored=False, processes=None, window=WINDOW,
+        laugh_times_margin=laugh_times_margin):
+    """
+    Merges one episode. All of the state of the merge is local to this call, so it can be used by several episodes
+    concurrently.
+    """
+    aligned_subs = merge(screenplay_path, srt_path, anchored, processes, window)
     laugh_times = parse_laugh_track(laugh_track_path)
-    laugh_times = remove_illegal_laugh_times(laugh_times, aligned_subs)
-    write_to_file(aligned_subs, laugh_times, output_path)
+    laugh_times = remove_illegal_laugh_times(laugh_times, aligned_subs, laugh_times_margin)
+    write_to_file(aligned_subs, laugh_times, output_path, laugh_times_margin)
 
 
-def write_to_file(aligned_subs, laugh_times, output):
-    with open(output, 'w', encoding='utf8', errors='ignore') as f:
-        for i, line in enumerate(aligned_subs):
+def write_to_file(aligned_subs, laugh_times, output, laugh_times_margin=laugh_times_margin):
+    """
+    Writes the merged data in a single pass. The laugh times are consumed with a cursor, so the output is written in
+    linear time.
+    :param aligned_subs: The output of merge().
+    :param laugh_times: A sorted list of laugh times (in seconds).
+    :param output: Output filename.
+    :param laugh_times_margin: The estimated time it takes the audience to laugh after a joke is delivered.
+    """
+    next_sub_start_times = get_next_sub_start_times(aligned_subs)
+    laugh_i = 0
+    with open(output, 'w', encoding='utf8', errors='ignore', buffering=WRITE_BUFFER_SIZE) as f:
+        for line, next_sub_start_time in zip(aligned_subs, next_sub_start_times):
             if isinstance(line, Subtitle):
-                f.write("%.3f\n" % line.start)
-                f.write("%s\n" % line.txt.strip())
-                f.write("%.3f\n" % line.end)
-                k = 1
-                try:
-                    while not isinstance(aligned_subs[i + k], Subtitle):
-                        k += 1
-                    next_sub_start_time = aligned_subs[i + k].start
-                except IndexError:
-                    next_sub_start_time = sys.float_info.max
-
-                while laugh_times \
-                        and line.start+laugh_times_margin <= laugh_times[0] <= next_sub_start_time+laugh_times_margin:
+                f.write("%.3f\n%s\n%.3f\n" % (line.start, line.txt.strip(), line.end))
+                while laugh_i < len(laugh_times) \
+                        and line.start+laugh_times_margin <= laugh_times[laugh_i] <= next_sub_start_time+laugh_times_margin:
                     # +0.5 because it takes the audience a moment to understand the joke
-                    f.write("%.3f\n" % laugh_times[0])
-                    f.write("**LOL**\n")
-                    laugh_times = laugh_times[1:]
+                    f.write("%.3f\n**LOL**\n" % laugh_times[laugh_i])
+                    laugh_i += 1
             else:
                 # character name
                 f.write("# %s" % line[1])
 
 
-def remove_illegal_laugh_times(laugh_times, aligned_subs):
+def get_next_sub_start_times(aligned_subs):
+    """
+    :param aligned_subs: The output of merge().
+    :return: A list in which the i-th item is the start time of the first Subtitle after aligned_subs[i]
+             (sys.float_info.max if there is none).
+    """
+    result = [sys.float_info.max] * len(aligned_subs)
+    next_sub_start_time = sys.float_info.max
+    for i in range(len(aligned_subs) - 1, -1, -1):
+        result[i] = next_sub_start_time
+        if isinstance(aligned_subs[i], Subtitle):
+            next_sub_start_time = aligned_subs[i].start
+    return result
+
+
+def remove_illegal_laugh_times(laugh_times, aligned_subs, laugh_times_margin=laugh_times_margin):
     """
     :param laughter_times:
     :param aligned_subtitles:
     :return: a fixed 'laughter_times' list
     """
+    first_sub = next(line for line in aligned_subs if isinstance(line, Subtitle))
+
     i = 0
-    while not isinstance(aligned_subs[i], Subtitle):
+    while i < len(laugh_times) and laugh_times[i] < first_sub.start + laugh_times_margin:
         i += 1
+    return laugh_times[i:]
 
-    while laugh_times[0] < aligned_subs[i].start + laugh_times_margin:
-        laugh_times = laugh_times[1:]
-    return laugh_times
 
-
-def merge(screenplay_path, srt_path):
+def merge(screenplay_path, srt_path, anchored=False, processes=None, window=WINDOW):
     """
 
     :param screenplay_path: path to a Seinfeld screenplay, in a READABLE format (generated by screenplay_parser.py).
     :param srt_path: path to a matching .srt subtitle file (make sure the timing is correct).
+    :param anchored: If True, split the alignment into segments between anchors (see get_anchored_match()). Useful for
+                     long & double episodes.
+    :param processes: The number of processes that align the segments in anchored mode (default: number of CPUs).
+    :param window: Maximum amount of subtitles (exclusive) that can be matched with a single dialog line.
     :return:
     """
     # read and parse data
@@ -95,10 +135,14 @@ def merge(screenplay_path, srt_path):
     # pre-process (replace all text with BOW)
     screenplay_bow = [(s[0], get_dialog_bow(s[1])) if s[0] == 'dialog' else s for s in screenplay_parsed]
     dialog_lines_bow = [line[1] for line in screenplay_bow if line[0] == 'dialog']
-    subs_bow = [Subtitle(txt=get_sub_bow(sub.txt), start=sub.start, end=sub.end) for sub in subs]
+    subs_bow = [get_sub_bow(sub.txt) for sub in subs]
+    dialog_lines_bits, subs_bits = get_bitsets(dialog_lines_bow, subs_bow)
 
     # process data
-    delimiters = get_optimal_match(dialog_lines_bow, subs_bow)
+    if anchored:
+        delimiters = get_anchored_match(dialog_lines_bits, subs_bits, processes, window)
+    else:
+        delimiters = get_optimal_match(dialog_lines_bits, subs_bits, window)
     aligned_subs = align_subtitles_with_screenplay(subs, screenplay_parsed, delimiters)
 
     return aligned_subs
@@ -144,39 +188,43 @@ def parse_laugh_track(laugh_track_txt_path):
 
 def parse_subtitles(srt):
     result = []
-    subs = pysrt.open(srt, encoding='ansi ', error_handling='ignore')
-    subs = remove_sound_descriptions(subs)
-    for i, sub in enumerate(subs):
-        if i and sub.text == subs[i-1].text:
+    subs = remove_sound_descriptions(srt_reader.read(srt))
+    previous_text = None
+    for sub in subs:
+        if sub.txt == previous_text:
             continue    # double subtitle
-        if re.search(r'\w{3,20}\.\w{2,20}', sub.text):
-            print("Commercial spotted, subtitle '%s' removed." % sub.text)
+        previous_text = sub.txt
+        if COMMERCIAL.search(sub.txt):
+            print("Commercial spotted, subtitle '%s' removed." % sub.txt)
+            continue
+        sub = sub._replace(txt=TAG.sub('', sub.txt.strip("-")))     # remove tags
+        if not sub.txt:
             continue
-        sub.text = sub.text.strip("-")
-        sub.text = re.sub(r'</?..?>', '', sub.text)     # remove tags
         splitted_subs = split_sub_if_it_has_more_than_one_character(sub)
-        for sub in splitted_subs:
-            result.append(sub)
+        if len(splitted_subs) == 1:
+            previous_text = splitted_subs[0].txt
+        else:
+            previous_text = sub.txt
+        result.extend(splitted_subs)
     return result
 
 
 def remove_sound_descriptions(subs):
     """
     Removes phrases that are enclosed with square brackets in the subtitles, for example [KNOCKING ON DOOR]
-    :param subs:
-    :return:
+    :param subs: A list of SrtItem objects (see srt_reader).
+    :return: A list of Subtitle objects.
     """
+    result = []
     for sub in subs:
-        if '[' in sub.text and ']' in sub.text:
-            t = sub.text
-            sub.text = t[:t.index('[')] + t[t.index(']') + 1:]
-            sub.text = sub.text.strip()
-        if '(' in sub.text and ')' in sub.text:
-            t = sub.text
-            sub.text = t[:t.index('(')] + t[t.index(')') + 1:]
-            sub.text = sub.text.strip()
-    subs = [sub for sub in subs if sub.text]
-    return subs
+        t = sub.text
+        if '[' in t and ']' in t:
+            t = (t[:t.index('[')] + t[t.index(']') + 1:]).strip()
+        if '(' in t and ')' in t:
+            t = (t[:t.index('(')] + t[t.index(')') + 1:]).strip()
+        if t:
+            result.append(Subtitle(txt=t, start=sub.start, end=sub.end))
+    return result
 
 
 def split_sub_if_it_has_more_than_one_character(sub):
@@ -184,109 +232,258 @@ def split_sub_if_it_has_more_than_one_character(sub):
     :param sub: a subtitle
     :return: a list of the splitted subtitles.
     """
-    result, splitted = [], []
-    start, end = get_sub_time_in_seconds(sub.start), get_sub_time_in_seconds(sub.end)
-    if '-'==sub.text[0] or '\n-' in sub.text:
+    splitted = []
+    start, end = sub.start, sub.end
+    if '-'==sub.txt[0] or '\n-' in sub.txt:
         # '-' in a subtitle denotes another speaker.
-        splitted = [s for s in re.split('(?:^-)|(?:\n-)',sub.text) if s]
-    elif ':' in sub.text:
+        splitted = [s for s in SPEAKER_DASH.split(sub.txt) if s]
+    elif ':' in sub.txt:
         # if the speaker name is in the subtitle, e.g. JERRY: I told you!, remove and split.
-        splitted = re.split(r'\w{3,10}:', sub.text)
+        splitted = SPEAKER_NAME.split(sub.txt)
         splitted = [s.strip() for s in splitted if s]
         if len(splitted) == 1:
-            sub.text = splitted[0].strip()
+            sub = sub._replace(txt=splitted[0].strip())
 
     if len(splitted) > 1:
         if len(splitted) > 2:
-            print("WARNING: problematic subtitle '%s'." % sub.text)
+            print("WARNING: problematic subtitle '%s'." % sub.txt)
             splitted = splitted[:2]
         sub_a, sub_b = splitted
         between_time = start/2 + end/2
-        result.append(Subtitle(txt=sub_a, start=start, end=between_time))
-        result.append(Subtitle(txt=sub_b, start=between_time, end=end))
+        return [Subtitle(txt=sub_a, start=start, end=between_time), Subtitle(txt=sub_b, start=between_time, end=end)]
     else:
-        result.append(Subtitle(txt=sub.text, start=start, end=end))
-    return result
-
+        return [sub]
 
-def get_sub_time_in_seconds(sub_time):
-    return sub_time.seconds + sub_time.minutes*60 + sub_time.milliseconds*0.001
 
-
-def get_optimal_match(dialog_lines, subtitles):
+def get_optimal_match(dialog_lines, subtitles, window=WINDOW):
     """
     A dynamic programming algorithm that returns the optimal screenplay/subtitles match.
     :param dialog_lines: A list of strings. Contains all the dialog lines being said. A dialog line here is NOT defined
                          as a line per se but as all the character has to say before being interrupted by another
                          character / a scene transition / the end.
-    :param subtitles: A list of Subtitle objects, as defined by the 'pysrt' package:
-                      https://github.com/byroot/pysrt
+    :param subtitles: A list of subtitles in bitset representation (see get_bitsets()).
+    :param window: Maximum amount of subtitles (exclusive) that can be matched with a single dialog line.
     :return: A list of delimiters (integers) that indicate the optimal match between the dialog and the subtitles.
              Those integers indicate where exactly to cut the subtitle list in order to get chunks that exactly match
              the dialog list.
     """
+    delimiters, stats = align(dialog_lines, subtitles, window)
+    print("Alignment evaluated %d cells (peak table memory: %.2f MB)." % (stats.cells, stats.peak_memory / 2**20))
+    return delimiters
+
+
+def get_anchored_match(dialog_lines, subtitles, processes=None, window=WINDOW):
+    """
+    A divide-and-conquer version of get_optimal_match(). High-confidence anchors (see find_anchors()) split the
+    alignment into independent segments, which are aligned in parallel. Falls back to get_optimal_match() when the
+    anchors are too sparse.
+    :param dialog_lines: A list of dialog lines in bitset representation.
+    :param subtitles: A list of subtitles in bitset representation.
+    :param processes: The number of worker processes (default: number of CPUs). 1 aligns the segments in-process.
+    :param window: Maximum amount of subtitles (exclusive) that can be matched with a single dialog line.
+    :return: A list of delimiters, as in get_optimal_match().
+    """
+    D, S = tuple(dialog_lines), tuple(subtitles)
+    anchors = find_anchors(D, S, window)
+    bounds = [(0, 0)] + anchors + [(len(D), len(S))]
+    largest_segment = max(db - da for (da, _), (db, _) in zip(bounds, bounds[1:]))
+    if largest_segment > MAX_SEGMENT_FRACTION * len(D):
+        print("Only %d anchors were found. Falling back to the full alignment." % len(anchors))
+        return get_optimal_match(D, S, window)
+
+    # the subtitles of a segment include the next anchor's subtitle, which must be left unmatched (fixed_end)
+    segments = [(D[da:db], S[ja:jb + 1], window, True) if db < len(D) else (D[da:], S[ja:], window, False)
+                for (da, ja), (db, jb) in zip(bounds, bounds[1:])]
+    print("Found %d anchors. Aligning %d segments..." % (len(anchors), len(segments)))
+    if processes == 1:
+        results = list(map(align_segment, segments))
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(align_segment, segments))
+
+    delimiters = [0]
+    for i, ((_, j), (segment_delimiters, stats, seconds)) in enumerate(zip(bounds, results)):
+        if segment_delimiters is None:
+            print("Segment %d could not be aligned. Falling back to the full alignment." % i)
+            return get_optimal_match(D, S, window)
+        print("Segment %d: %d dialog lines, %d subtitles, %d cells, %.2f seconds." %
+              (i, len(segments[i][0]), len(segments[i][1]), stats.cells, seconds))
+        delimiters.extend(j + delimiter for delimiter in segment_delimiters[1:])
+    return delimiters
+
+
+def align_segment(segment):
+    """
+    Aligns one segment of get_anchored_match() (runs in a worker process).
+    :param segment: A tuple (dialog lines, subtitles, window, fixed_end).
+    :return: A tuple (delimiters, AlignmentStats, seconds). delimiters & stats are None if there is no valid match.
+    """
+    dialog_lines, subtitles, window, fixed_end = segment
+    start = timer()
+    try:
+        delimiters, stats = align(dialog_lines, subtitles, window, fixed_end)
+    except ValueError:
+        delimiters, stats = None, None
+    return delimiters, stats, timer() - start
+
+
+def find_anchors(dialog_lines, subtitles, window=WINDOW):
+    """
+    Finds high-confidence anchors: multi-word dialog lines that match exactly one subtitle, where both the dialog line
+    and the subtitle are unique. Only the longest chain of anchors that are ordered the same way in the screenplay
+    and in the subtitles is kept, and only anchors that can be reached from the previous one within 'window'.
+    :param dialog_lines: A tuple of dialog lines in bitset representation.
+    :param subtitles: A tuple of subtitles in bitset representation.
+    :return: A sorted list of (dialog line index, subtitle index) tuples.
+    """
+    dialog_counts, subtitle_counts = Counter(dialog_lines), Counter(subtitles)
+    subtitle_indices = {bits: j for j, bits in enumerate(subtitles) if subtitle_counts[bits] == 1}
+    candidates = [(d, subtitle_indices[bits]) for d, bits in enumerate(dialog_lines)
+                  if d and dialog_counts[bits] == 1 and bits in subtitle_indices
+                  and popcount(bits) >= MIN_ANCHOR_WORDS]
+
+    # longest increasing subsequence of the subtitle indices (candidates are sorted by dialog index)
+    tails, tails_i, previous = [], [], []
+    for i, (_, j) in enumerate(candidates):
+        pos = bisect_left(tails, j)
+        previous.append(tails_i[pos - 1] if pos else None)
+        if pos == len(tails):
+            tails.append(j)
+            tails_i.append(i)
+        else:
+            tails[pos] = j
+            tails_i[pos] = i
+    chain = []
+    i = tails_i[-1] if tails_i else None
+    while i is not None:
+        chain.append(candidates[i])
+        i = previous[i]
+    chain.reverse()
+
+    # every dialog line is matched with less than 'window' subtitles
+    anchors = []
+    last_d, last_j = 0, 0
+    for d, j in chain:
+        if j - last_j <= (d - last_d) * (window - 1):
+            anchors.append((d, j))
+            last_d, last_j = d, j
+    return anchors
+
+
+def align(dialog_lines, subtitles, window=WINDOW, fixed_end=False):
+    """
+    The engine behind get_optimal_match(). The table is indexed by integer offsets: cell (d, j) holds the best match
+    of the dialog lines D[d:] with the subtitles S[j:].
+    Since every dialog line consumes less than 'window' subtitles, the cells reachable from (0, 0) in row d are
+    limited to j <= d * (window - 1), so only that band is calculated. Only 2 rows of scores are kept in memory,
+    along with a backpointer (the chosen k) for each cell of the band.
+    :param dialog_lines: A list of dialog lines in bitset representation.
+    :param subtitles: A list of subtitles in bitset representation.
+    :param window: Maximum amount of subtitles (exclusive) that can be matched with a single dialog line.
+    :param fixed_end: If True, all of the subtitles but the last one must be matched with the dialog.
+    :return: A tuple (delimiters, AlignmentStats).
+    """
     D = tuple(dialog_lines)
     S = tuple(subtitles)
+    n, m = len(D), len(S)
+    if not m:
+        raise ValueError("There are no subtitles to align the screenplay with.")
+    if window > 256:
+        raise ValueError("window must not exceed 256 (backpointers are stored as bytes).")
+
+    # row d of the band covers the subtitles S[0:widths[d]]
+    widths = [min(m, d * (window - 1) + 1) for d in range(n)]
+    offsets = [0]
+    for width in widths:
+        offsets.append(offsets[-1] + width)
+
+    backpointers = bytearray(offsets[-1])
+    next_row = array('d', bytes(8 * m))     # scores of row d+1 (the last row, where no dialog is left, is all 0)
+    row = array('d', bytes(8 * m))
+    if fixed_end:
+        next_row = array('d', [-float('inf')] * m)
+        next_row[m - 1] = 0
 
     # calculate dynamic programming table
-    for i in range(1, len(D) + 1):
-        for j in range(len(S)):
-            match[ D[-i:] ][ S[j:] ] = get_max_k(D[-i:], S[j:])
+    cells = 0
+    for d in range(n - 1, -1, -1):
+        offset = offsets[d]
+        for j in range(widths[d]):
+            k, row[j] = get_max_k(D[d], S, j, next_row, window)
+            backpointers[offset + j] = k
+        cells += widths[d]
+        row, next_row = next_row, row
+    if next_row[0] == -float('inf'):
+        raise ValueError("The subtitles can't be fully matched with the dialog.")
 
     # backtrack solution
     delimiters = [0]
-    k = 0
-    while D:
-        k = match[D][S].k
-        delimiters.append(k + delimiters[-1])
-        D = D[1:]
-        S = S[k:]
-    return delimiters
+    j = 0
+    for d in range(n):
+        j += backpointers[offsets[d] + j]
+        delimiters.append(j)
+
+    peak_memory = sys.getsizeof(backpointers) + sys.getsizeof(row) + sys.getsizeof(next_row)
+    return delimiters, AlignmentStats(cells=cells, peak_memory=peak_memory)
 
 
-def get_max_k(D, S):
+def get_max_k(dialog_line, S, j, next_row, window=WINDOW):
     """
     finds a k that maximizes the score of the match
-    :param D: A tuple of dialog lines.
-    :param S: A tuple of subtitles.
+    :param dialog_line: A dialog line in bitset representation.
+    :param S: A tuple of subtitles in bitset representation.
+    :param j: The offset of the first subtitle that may be matched with the dialog line.
+    :param next_row: The scores of the optimal match of the rest of the dialog lines, indexed by subtitle offset.
+    :param window: Maximum amount of subtitles (exclusive) that can be matched with the dialog line.
     :return: The k (the partition point) which maximizes the matching score.
     """
-    # A limit for the amount of subtitles that can fit a line of dialog.
-    # (Without a reasonable pruning window, calculation becomes too slow.)
-    WINDOW = 16
-
-    max_score = 0
+    max_score = -float('inf')
     max_k = 0
 
-    for k in range(min(WINDOW, len(S))):
-        s = get_score(D[0], S[:k]) + match[ D[1:] ][ S[k:] ].score
+    words_from_subtitles = 0    # the union of S[j:j+k], built incrementally as k grows
+    for k in range(min(window, len(S) - j)):
+        s = get_score(dialog_line, words_from_subtitles) + next_row[j + k]
         if s > max_score:
             max_score = s
             max_k = k
+        words_from_subtitles |= S[j + k]
 
     return Result(k=max_k, score=max_score)
 
 
-def get_score(words_from_dialog, subs):
+def get_score(words_from_dialog, words_from_subtitles):
     """
-    :param subs: A list containing the substitles we try to match to this dialog line. sub.txt has to be BOW.
-    :param words_from_dialog:  A dialog line (i.e. a character's dialog block from the screenplay) in BOW representation.
-    :return: the matching's score.
+    :param words_from_dialog: A dialog line (i.e. a character's dialog block from the screenplay) in bitset
+                              representation.
+    :param words_from_subtitles: The union of the subtitles we try to match to this dialog line, in bitset
+                                 representation.
+    :return: the matching's score (the Jaccard index of the two bags of words).
     """
-    # will run untill match cannot improve anymore
-    try:
-        words_from_subtitles = frozenset.union(*(sub.txt for sub in subs))
-    except TypeError:
-        # no subtitles
-        words_from_subtitles = frozenset()
-
-    # calculate BOW intersection and union
-    intersection = len(words_from_dialog & words_from_subtitles)
-    union = len(words_from_dialog | words_from_subtitles)
+    intersection = popcount(words_from_dialog & words_from_subtitles)
+    union = popcount(words_from_dialog | words_from_subtitles)
 
     return intersection / union
 
 
+def get_bitsets(dialog_lines_bow, subs_bow):
+    """
+    Interns every word into a shared vocabulary, and converts each BOW into a bitset (an int in which bit i is set if
+    the i-th word of the vocabulary is in the BOW). Unions and intersections then become bitwise operations.
+    :param dialog_lines_bow: A list of dialog lines in BOW representation.
+    :param subs_bow: A list of subtitles in BOW representation.
+    :return: A tuple (dialog lines bitsets, subtitles bitsets).
+    """
+    vocabulary = {}
+
+    def to_bitset(bow):
+        bits = 0
+        for word in bow:
+            bits |= 1 << vocabulary.setdefault(word, len(vocabulary))
+        return bits
+
+    return [to_bitset(bow) for bow in dialog_lines_bow], [to_bitset(bow) for bow in subs_bow]
+
+
 def get_sub_bow(sub_txt):
     sub_txt = re.sub(r'\\', '', sub_txt)     # remove escape characters from subtitles.
     return get_bow(sub_txt)
@@ -339,10 +536,18 @@ if __name__ == '__main__':
     parser.add_argument('srt', help='A matching subtitles file')
     parser.add_argument('laugh_track', help='Timestamps of laughs in the laugh-track as put together by laugh_times_extractor.py')
     parser.add_argument('output', help="Output filename.")
+    parser.add_argument('--anchored', action='store_true',
+                        help="Split the alignment into segments between anchors and align them in parallel "
+                             "(useful for long & double episodes).")
+    parser.add_argument('--processes', type=int, help="Number of processes for the anchored alignment.")
+    parser.add_argument('--window', type=int, default=WINDOW,
+                        help="Maximum amount of subtitles (exclusive) that can be matched with a dialog line.")
+    parser.add_argument('--margin', type=float, default=laugh_times_margin,
+                        help="The estimated time (in seconds) it takes the audience to laugh after a joke.")
     args = parser.parse_args()
     screenplay, srt, laugh_track, output = args.screenplay, args.srt, args.laugh_track, args.output
 
     if os.path.exists(output):
         print("'%s' already exists!\n" % output)
     else:
-        result = run(screenplay, srt, laugh_track, output)
+        result = run(screenplay, srt, laugh_track, output, args.anchored, args.processes, args.window, args.margin)
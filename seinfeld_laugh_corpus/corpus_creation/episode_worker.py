@@ -0,0 +1,43 @@
+"""
+A long-lived worker process of create_corpus: the processing code (numpy, scipy, the subtitle & screenplay getters...)
+is imported once, and then the worker processes the episodes whose paths it reads from its stdin (one per line), one
+after the other, until its stdin is closed.
+
+The worker prints READY once it's done importing, and DONE after every episode. Everything else it prints is the
+output of the processing of the current episode.
+"""
+import argparse
+import sys
+import traceback
+
+READY = "WORKER READY"
+DONE = "WORKER DONE"
+
+
+def run(processes=None, keep_merge_inputs=False):
+    """
+    :param processes: The number of processes that the processing of an episode may use (see Processor).
+    :param keep_merge_inputs: Keep the inputs of the episodes' merges (see Processor).
+    """
+    # imported here rather than at the top, so create_corpus can import this module's constants without it.
+    import processor
+    print(READY, flush=True)
+    for line in sys.stdin:
+        file_path = line.rstrip('\n')
+        try:
+            processor.run(file_path, processes=processes, keep_merge_inputs=keep_merge_inputs)
+        except Exception as e:
+            # an episode must never take the worker (and the episodes after it) down with it.
+            print("ERROR for '%s': %s" % (file_path, str(e)))
+            traceback.print_exc()
+        print(DONE, flush=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Process the episodes whose paths are read from stdin.")
+    parser.add_argument('--processes', type=int, help="Number of processes per episode (default: the number of CPUs).")
+    parser.add_argument('--keep-merge-inputs', action='store_true',
+                        help="Keep the .formatted, .srt & .laugh files of the episodes.")
+    args = parser.parse_args()
+
+    run(args.processes, args.keep_merge_inputs)
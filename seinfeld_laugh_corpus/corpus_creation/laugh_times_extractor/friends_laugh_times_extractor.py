@@ -5,7 +5,7 @@ from collections import namedtuple
 from numpy import mean, array_split, array, median, std, sqrt, isinf
 from scipy.io.wavfile import read
 
-from seinfeld_laugh_corpus.corpus_creation.laugh_times_extractor.laugh_times_extractor import LaughTimesExtractor
+from .laugh_times_extractor import LaughTimesExtractor
 
 
 def run(input, output):
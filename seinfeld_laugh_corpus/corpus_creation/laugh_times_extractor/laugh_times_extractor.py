@@ -2,13 +2,13 @@ import argparse
 import sys
 from collections import namedtuple
 
-from numpy import mean, array_split, array, median, std, sqrt, isinf
-from scipy.io.wavfile import read
+from numpy import mean, median, std, isinf, array, flatnonzero, inf
+from scipy.ndimage import maximum_filter1d
 
 sys.path.insert(0, '..')
 sys.path.insert(0, '.')
 
-from seinfeld_laugh_corpus.corpus_creation.utils.utils import log10wrapper
+from utils import envelope
 
 Laugh = namedtuple('Laugh', ['time', 'vol'])
 
@@ -32,48 +32,38 @@ class LaughTimesExtractor:
 
     def _get_laughters(self, dbs):
         """
+        A laugh is a peak: a chunk that is as loud as all of the chunks in the 3 seconds before it (if there are any)
+        and in the 3 seconds after it (until the end), and the mean volume of the second around it is above the
+        silence threshold.
         :return: an array of the laugh timestamps in seconds.
         """
-        dbs_without_infs = [dB for dB in dbs if not isinf(dB)]
+        dbs = array(dbs, dtype='float64')
+        dbs_without_infs = dbs[~isinf(dbs)]
         silence_threshold = mean(dbs_without_infs)
 
+        detection_rng = 3 * self.db_measurement_chunks_per_second
+        vol_measurement_rng = int(1 * self.db_measurement_chunks_per_second)
+
+        # forward_max[i] is the maximum of dbs[i:i+detection_rng]
+        forward_max = maximum_filter1d(dbs, detection_rng, mode='constant', cval=-inf, origin=-(detection_rng // 2))
+        is_a_peak = forward_max <= dbs
+        is_a_peak[detection_rng:] &= forward_max[:-detection_rng] <= dbs[detection_rng:]
+        is_a_peak[:vol_measurement_rng] = False     # the volume of the second around it can't be measured
+
         laughters = []
-        for i in range(len(dbs)):
-            s, fullness, m, result = self._is_a_peak(dbs, i, silence_threshold)
-            if result:
+        for i in flatnonzero(is_a_peak).tolist():
+            mean_of_interval = dbs[i-vol_measurement_rng:i+vol_measurement_rng].mean()
+            if mean_of_interval > silence_threshold:
                 total_seconds = i/self.db_measurement_chunks_per_second
-                laughters.append(Laugh(time=total_seconds, vol=m))
+                laughters.append(Laugh(time=total_seconds, vol=mean_of_interval))
         return laughters
 
     def _get_audio_dbs(self, audio_file):
         """
-        :param audio_file: The path to the episode's audio file.
+        :param audio_file: The path to the episode's audio file (.wav), or to its saved envelope (.npz).
         :return: an array of calculated dB measurements for the audio file.
         """
-        samples_per_second, wavdata = read(audio_file, mmap=True)
-
-        # split audio to chunks to measure Db
-        numchunks = int((len(wavdata) / samples_per_second) * self.db_measurement_chunks_per_second)
-        chunks = array_split(wavdata, numchunks)
-        chunks = [array(chunk, dtype='int64') for chunk in chunks]      # to prevent integer overflow
-        dbs = [20*log10wrapper( mean(sqrt((chunk / 32767)**2)) ) for chunk in chunks]     # list of dB values for the chunks
-
-        return dbs
-
-    def _is_a_peak(self, dbs, i, silence_threshold):
-        detection_rng = 3 * self.db_measurement_chunks_per_second
-        vol_measurement_rng = int(1 * self.db_measurement_chunks_per_second)
-
-        try:
-            if all(dB <= dbs[i] for dB in dbs[i:i+detection_rng]) and all(dbs[i] >= dB for dB in dbs[i-detection_rng:i]):
-                # is a peak
-                mean_of_interval = mean(dbs[i-vol_measurement_rng:i+vol_measurement_rng])
-                if mean_of_interval > silence_threshold:
-                    std_of_interval = std(dbs[i-vol_measurement_rng:i+vol_measurement_rng])
-                    return std_of_interval, dbs[i], mean_of_interval, True
-        except IndexError:
-            return None, None, None, None
-        return None, None, None, None
+        return envelope.get_audio_dbs(audio_file, self.db_measurement_chunks_per_second)
 
     def _verify_result(self, laughters, dbs):
         l_m = mean([l. vol for l in laughters])
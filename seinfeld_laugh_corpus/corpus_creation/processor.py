@@ -1,20 +1,42 @@
 import argparse
 import ntpath
 import os
+import re
+import shutil
 import subprocess
+import sys
 import traceback
 import importlib
+from collections import namedtuple
 
-from config import FFMPEG_PATH, SOX_PATH
+from config import FFMPEG_PATH, SOX_PATH, AUDIO_PROFILE, SHOW_NAME
 from data_merger import data_merger
+from utils import envelope, stage_cache
 
 # internal imports
 from subtitle_getter import subtitle_getter
 from subtitle_getter.subtitle_getter import SubtitlesNotInSyncException
 
 
-def run(file_path):
-    processor = Processor(file_path)
+# the sox effects that normalize the audio, and that extract the laugh track from it (see _extract_audio_tracks()).
+NORMALIZE_EFFECT = ["gain", "-n"]
+LAUGH_TRACK_EFFECT = ["oops"]
+
+# ffmpeg's codecs of text subtitles, which can be converted to .srt (bitmap subtitles can't).
+TEXT_SUBTITLE_CODECS = ('subrip', 'srt', 'ass', 'ssa', 'mov_text', 'webvtt', 'text')
+
+# a stage of the processing DAG. 'inputs' & 'outputs' are keys of Processor.temp_files (a stage's inputs are outputs of
+# the stages before it), 'settings' is everything else that its outputs depend on (e.g. the version of its code).
+Stage = namedtuple('Stage', ['name', 'run', 'inputs', 'outputs', 'settings'])
+
+# the keys of the .wav files in Processor.temp_files.
+AUDIO_TRACKS = ('audio', 'norm_audio', 'laugh_track')
+
+
+def run(file_path, stream_audio=False, keep_audio=False, audio_profile=AUDIO_PROFILE, use_cache=True, processes=None,
+        keep_merge_inputs=False):
+    processor = Processor(file_path, stream_audio=stream_audio, keep_audio=keep_audio, audio_profile=audio_profile,
+                          use_cache=use_cache, processes=processes, keep_merge_inputs=keep_merge_inputs)
     processor.process()
 
 
@@ -23,14 +45,37 @@ class Processor:
     A class that generates corpus data from a Seinfeld episode in the .mkv file format.
     """
 
-    def __init__(self, filepath, show_name='bbt'):
+    def __init__(self, filepath, show_name=SHOW_NAME, stream_audio=False, keep_audio=False, audio_profile=AUDIO_PROFILE,
+                 use_cache=True, processes=None, keep_merge_inputs=False):
         """
         :param filepath: Path of the video file of the episode. Output will be written in the same path as the input's.
         :param show_name: Supported shows are 'seinfeld', 'friends' and 'bbt' (Big Bang Theory).
+        :param stream_audio: Pipe the audio from ffmpeg and calculate the envelopes of the audio & of the laugh track in
+                             one pass, instead of writing the audio, the normalized audio & the laugh track to .wav files.
+        :param keep_audio: Write the intermediate .wav files and keep them after processing (for debugging). Overrides
+                           stream_audio.
+        :param audio_profile: 'full' keeps the video's sample rate, 'reduced' resamples the audio during extraction to
+                              the lowest rate the dB envelopes need (both channels are kept, for the laugh track).
+        :param use_cache: Copy the outputs of stages whose inputs, code & settings haven't changed since they last ran
+                          from the stage cache (see stage_cache), instead of running them again.
+        :param processes: The number of processes that the merge of a double episode may use (default: the number of
+                          CPUs, see data_merger.get_anchored_match()).
+        :param keep_merge_inputs: Keep the formatted screenplay, the subtitles & the laugh times after processing, so
+                                  the episode can be merged again (see data_merger/batch_merger.py).
         """
         self.filepath = filepath
         self.temp_files = {}               # paths of all the temporary files that will be used in the processing
-        self.files_to_keep = []
+        self.files_to_keep = list(AUDIO_TRACKS) if keep_audio else []
+        if keep_merge_inputs:
+            self.files_to_keep += ['formatted_screenplay', 'subtitles', 'laughter_times']
+        self.stream_audio = stream_audio and not keep_audio
+        if audio_profile not in ('full', 'reduced'):
+            raise Exception("Unknown audio profile '%s'." % audio_profile)
+        self.audio_profile = audio_profile
+        self.stage_cache = stage_cache.StageCache() if use_cache else None
+        self.processes = processes
+        self.hashes = {}                   # content hashes of the stages' outputs, by their keys in self.temp_files
+        self.unsaved_stages = []           # stages whose outputs are cached once the following stages ran
         self.filename = ntpath.basename(self.filepath)
         self.merged_filename = self.filepath.rsplit(".", 1)[0] + '.merged'
         self.full_show_name = show_name if show_name != 'bbt' else 'big bang theory'
@@ -60,13 +105,8 @@ class Processor:
                 print("Skipping '%s' - file already exists." % self.merged_filename)
                 return
             print("Processing '%s'..." % self.filename)
-            self._extract_audio()
-            self._normalize_audio()
-            self._extract_laugh_track()
-            self._extract_laughter_times()
-            self._get_subtitles()
-            self._get_screenplay()
-            self._parse_screenplay()
+            for stage in self._get_stages():
+                self._run_stage(stage)
             self._merge_data()
         except LaughExtractionException as e:
             print("ERROR for '%s': Laugh extraction error. %s" % (self.filename, e))
@@ -83,30 +123,234 @@ class Processor:
         else:
             print("SUCCESS for '%s'." % self.filename)
         finally:
+            if self.unsaved_stages:
+                self._save_audio_stages()
             print("Cleaning up...")
             self._cleanup()
 
+    def _get_stages(self):
+        """
+        The merge isn't a stage: its output is the final .merged file, and the episode is skipped once it exists.
+        :return: A list of the processing stages (see Stage), in an order in which they can run.
+        """
+        extractor, downloader, parser = (self.dependencies[name] for name in
+                                         ('laugh_times_extractor', 'screenplay_downloader', 'screenplay_parser'))
+        # an existing subtitles file next to the video is used instead of extracting or downloading subtitles.
+        subtitles = self.filepath.rsplit(".", 1)[0] + '.srt'
+        existing_subtitles = stage_cache.hash_file(subtitles) if os.path.exists(subtitles) else None
+        # the stages run through this module, so its code is a part of all of theirs.
+        this_module = sys.modules[__name__]
+        return [
+            Stage('audio', self._stream_audio if self.stream_audio else self._extract_audio_tracks,
+                  inputs=[], outputs=['audio', 'laugh_track', 'subtitles'],
+                  settings={'video': stage_cache.fingerprint_file(self.filepath), 'stream_audio': self.stream_audio,
+                            'audio_profile': self.audio_profile, 'commands': self._get_audio_commands(),
+                            'code': stage_cache.get_code_version(this_module, envelope)}),
+            Stage('laughter_times', self._extract_laughter_times,
+                  inputs=['laugh_track'], outputs=['laughter_times'],
+                  settings={'code': stage_cache.get_code_version(this_module, type(extractor), envelope)}),
+            Stage('subtitles', self._get_subtitles,
+                  inputs=['audio', 'subtitles'], outputs=['subtitles'],
+                  settings={'episode': self.filename, 'show': self.full_show_name, 'existing': existing_subtitles,
+                            'code': stage_cache.get_code_version(this_module, subtitle_getter,
+                                                                 subtitle_getter.srt_reader, envelope)}),
+            Stage('screenplay', self._get_screenplay,
+                  inputs=[], outputs=['screenplay'],
+                  settings={'episode': self.filename,
+                            'code': stage_cache.get_code_version(this_module, type(downloader))}),
+            Stage('formatted_screenplay', self._parse_screenplay,
+                  inputs=['screenplay'], outputs=['formatted_screenplay'],
+                  settings={'code': stage_cache.get_code_version(this_module, type(parser))}),
+        ]
+
+    def _run_stage(self, stage):
+        """
+        Runs a stage, unless its outputs for the current contents of its inputs (and for its current settings) are in
+        the stage cache, in which case they're copied from the cache instead.
+        """
+        if self.stage_cache is None:
+            stage.run()
+            return
+
+        inputs = {name: self.hashes.get(name) for name in stage.inputs}
+        key = self.stage_cache.get_key(stage.name, {'inputs': inputs, 'settings': stage.settings})
+        # audio tracks that are kept (for debugging) must actually be produced, the cache only has their envelopes.
+        if not set(stage.outputs) & set(self.files_to_keep) & set(AUDIO_TRACKS):
+            cached = self.stage_cache.load(stage.name, key, os.path.dirname(self.filepath))
+            if cached is not None:
+                print("Using the cached outputs of the '%s' stage." % stage.name)
+                for name, (path, content_hash) in cached.items():
+                    self.temp_files[name] = path
+                    self.hashes[name] = content_hash
+                return
+
+        stage.run()
+        outputs = {name: (self.temp_files[name], ntpath.basename(self.temp_files[name]))
+                   for name in stage.outputs if name in self.temp_files}
+        # the .wav files are too big to hash, they're identified by their fingerprints.
+        hashes = {name: stage_cache.fingerprint_file(path) if path.endswith('.wav') else stage_cache.hash_file(path)
+                  for name, (path, _) in outputs.items()}
+        self.hashes.update(hashes)
+        if not any(path.endswith('.wav') for path, _ in outputs.values()):
+            self.stage_cache.save(stage.name, key, outputs, hashes)
+            return
+
+        # the audio tracks are cached as their envelopes, but only once the following stages calculated them (see
+        # _save_audio_stages()). The other outputs may change until then (e.g. the subtitles are resynced).
+        for name, (path, filename) in outputs.items():
+            if not path.endswith('.wav'):
+                self.temp_files[name + '_unsaved'] = path + '.unsaved'
+                shutil.copyfile(path, self.temp_files[name + '_unsaved'])
+                outputs[name] = (self.temp_files[name + '_unsaved'], filename)
+        self.unsaved_stages.append((stage.name, key, outputs, hashes))
+
+    def _save_audio_stages(self):
+        """
+        Caches the outputs of the stages that produced .wav files, as the envelopes of the .wav files (which is all that
+        the following stages read from them). Calculating an envelope reads the whole track, so it's left to the
+        stages that need it (e.g. the sampled subtitle validation doesn't). A stage whose envelopes weren't all
+        calculated isn't cached.
+        """
+        for stage_name, key, outputs, hashes in self.unsaved_stages:
+            cached_forms = {}
+            for name, (path, filename) in outputs.items():
+                if path.endswith('.wav'):
+                    path = envelope.get_cache_path(path) if os.path.isfile(path) else None
+                    filename = filename.rsplit(".", 1)[0] + '.envelope.npz'
+                if path is None or not os.path.isfile(path):
+                    print("The outputs of the '%s' stage aren't cached (its audio tracks weren't all read)." %
+                          stage_name)
+                    break
+                cached_forms[name] = (path, filename)
+            else:
+                self.stage_cache.save(stage_name, key, cached_forms, hashes)
+        self.unsaved_stages = []
+
+    def _extract_audio_tracks(self):
+        self._extract_audio()
+        self._normalize_audio()
+        self._extract_laugh_track()
+
     def _extract_audio(self):
         print("Extracting audio...")
         # audio file name is the same as the video's but with .wav extension
         self.temp_files['audio'] = self.filepath.rsplit(".", 1)[0] + '.wav'
         try:
             # ffmpeg will extract the audio in uncompressed PCM format.
-            exit_code = subprocess.call([os.path.join(FFMPEG_PATH, 'ffmpeg.exe'), "-i", self.filepath,
-                                         self.temp_files['audio']], stdout=subprocess.DEVNULL)
-            if exit_code != 0:
-                raise Exception("ffmpeg exit code: %d. Your video file may be corrupted." % exit_code)
+            self._demux(self._get_audio_output_args() + [self.temp_files['audio']])
         except Exception as e:
             del self.temp_files['audio']
             raise Exception("Make sure you have a working version of ffmpeg in the external_tools folder.\n%s" % str(e))
 
+    def _stream_audio(self):
+        print("Streaming audio...")
+        # the envelopes replace the audio & the laugh track .wav files in the following stages.
+        base_name = self.filepath.rsplit(".", 1)[0]
+        try:
+            # ffmpeg will write the audio to its stdout in uncompressed stereo PCM format.
+            audio_envelope, laugh_track_envelope = self._demux(self._get_audio_output_args() + ["-"],
+                                                               read_audio=envelope.get_stream_envelopes)
+        except Exception as e:
+            raise Exception("Make sure you have a working version of ffmpeg in the external_tools folder.\n%s" % str(e))
+
+        self.temp_files['audio'] = base_name + '.envelope.npz'
+        envelope.save_envelope(audio_envelope, self.temp_files['audio'])
+        self.temp_files['laugh_track'] = base_name + '_laugh.envelope.npz'
+        envelope.save_envelope(laugh_track_envelope, self.temp_files['laugh_track'])
+
+    def _demux(self, audio_output, read_audio=None):
+        """
+        Extracts the audio and the first subtitle stream of the video in one ffmpeg pass, so the video is only read
+        once. The subtitles are only extracted if the video has a text subtitle stream (see _probe_subtitles()). If
+        they still can't be extracted, only the audio is extracted.
+        :param audio_output: ffmpeg output options & file name of the audio ('-' for stdout). ffmpeg selects the audio
+                             stream of this output as it would without the subtitles.
+        :param read_audio: If the audio is written to stdout, a function that reads it from a file object.
+        :return: The result of read_audio.
+        """
+        subtitles = self.filepath.rsplit(".", 1)[0] + '.srt'
+        attempts = [(False, audio_output)]
+        if not os.path.exists(subtitles) and self._probe_subtitles():
+            # -map is an option of the output file that follows it, so it doesn't change the audio's stream selection.
+            attempts.insert(0, (True, audio_output + ["-map", "0:s:0", subtitles]))
+
+        for with_subtitles, output in attempts:
+            process = subprocess.Popen([os.path.join(FFMPEG_PATH, 'ffmpeg.exe'), "-y", "-i", self.filepath] + output,
+                                       stdout=subprocess.PIPE if read_audio else subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL if read_audio else None)
+            result, error = None, None
+            if read_audio:
+                with process.stdout:
+                    try:
+                        result = read_audio(process.stdout)
+                    except Exception as e:
+                        error = e
+            exit_code = process.wait()
+            if exit_code == 0 and error is None:
+                if with_subtitles:
+                    self.temp_files['subtitles'] = subtitles
+                return result
+            if with_subtitles:
+                print("Couldn't extract the subtitles along with the audio. Extracting the audio only...")
+                if os.path.exists(subtitles):
+                    os.remove(subtitles)
+        raise Exception(str(error) if error else "ffmpeg exit code: %d. Your video file may be corrupted." % exit_code)
+
+    def _probe_subtitles(self):
+        """
+        :return: True if the first subtitle stream of the video is in a text format, False if the video has no
+                 subtitles, or if they are bitmaps (they will be downloaded instead).
+        """
+        try:
+            output = subprocess.check_output([os.path.join(FFMPEG_PATH, 'ffprobe.exe'), "-v", "error",
+                                              "-select_streams", "s:0", "-show_entries", "stream=codec_name",
+                                              "-of", "csv=p=0", self.filepath], stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print("Couldn't probe the video for subtitles (%s). Extracting the audio only..." % str(e))
+            return False
+        codec = output.decode('utf-8', 'replace').strip()
+        if not codec:
+            print("The video has no subtitles.")
+            return False
+        if codec not in TEXT_SUBTITLE_CODECS:
+            print("The video's subtitles are bitmaps ('%s'), they can't be extracted." % codec)
+            return False
+        return True
+
+    def _get_audio_output_args(self):
+        """
+        :return: The ffmpeg output options of the audio (without its file name).
+        """
+        if self.stream_audio:
+            return ["-vn", "-ac", "2"] + self._get_audio_profile_args() + ["-acodec", "pcm_s16le", "-f", "wav"]
+        return self._get_audio_profile_args()
+
+    def _get_audio_commands(self):
+        """
+        :return: The options of the tools that produce the outputs of the audio stage (so the stage cache is keyed on
+                 them).
+        """
+        commands = {'ffmpeg': self._get_audio_output_args()}
+        if not self.stream_audio:
+            commands['sox'] = [NORMALIZE_EFFECT, LAUGH_TRACK_EFFECT]
+        return commands
+
+    def _get_audio_profile_args(self):
+        """
+        :return: The ffmpeg output options of the audio profile.
+        """
+        if self.audio_profile == 'reduced':
+            # ffmpeg's resampler low-passes the audio below the new Nyquist frequency.
+            return ["-ar", str(envelope.get_reduced_sample_rate())]
+        return []
+
     def _normalize_audio(self):
         print("Normalizing audio...")
         # audio file name is the same as the video's but with .wav extension
         self.temp_files['norm_audio'] = self.filepath.rsplit(".", 1)[0] + '_norm.wav'
         try:
             exit_code = subprocess.call([os.path.join(SOX_PATH, 'sox.exe'), self.temp_files['audio'],
-                                         self.temp_files['norm_audio'], "gain", "-n"], stdout=subprocess.DEVNULL)
+                                         self.temp_files['norm_audio']] + NORMALIZE_EFFECT, stdout=subprocess.DEVNULL)
             if exit_code != 0:
                 raise Exception("sox exit code: %d. Could not normalize audio." % exit_code)
         except Exception as e:
@@ -119,7 +363,8 @@ class Processor:
 
         try:
             exit_code = subprocess.call([os.path.join(SOX_PATH, 'sox.exe'), self.temp_files['norm_audio'],
-                                         self.temp_files['laugh_track'], "oops"], stdout=subprocess.DEVNULL)
+                                         self.temp_files['laugh_track']] + LAUGH_TRACK_EFFECT,
+                                        stdout=subprocess.DEVNULL)
             if exit_code != 0:
                 raise Exception("sox exit code: %d." % exit_code)
         except Exception as e:
@@ -128,7 +373,7 @@ class Processor:
 
     def _extract_laughter_times(self):
         print("Extracting laughter times...")
-        self.temp_files['laughter_times'] = self.temp_files['laugh_track'].rsplit(".", 1)[0] + '.laugh'
+        self.temp_files['laughter_times'] = self.filepath.rsplit(".", 1)[0] + '_laugh.laugh'
         try:
             extractor = self.dependencies['laugh_times_extractor']
             extractor.run(input=self.temp_files['laugh_track'], output=self.temp_files['laughter_times'])
@@ -141,7 +386,9 @@ class Processor:
         # audio file name is the same as the video's but with .wav extension
         self.temp_files['subtitles'] = self.filepath.rsplit(".", 1)[0] + '.srt'
         try:
-            subtitle_getter.run(self.filepath, self.temp_files['audio'], self.temp_files['subtitles'], self.full_show_name)
+            # the subtitles were already extracted from the video (if it has any) along with the audio.
+            subtitle_getter.run(self.filepath, self.temp_files['audio'], self.temp_files['subtitles'], self.full_show_name,
+                                extract_subtitles=False)
         except Exception as e:
             del self.temp_files['subtitles']
             raise Exception("Error getting subtitles: %s" % str(e))
@@ -169,8 +416,11 @@ class Processor:
     def _merge_data(self):
         print("Merging all data to one file (this will take a while)...")
         merged_filename = self.filepath.rsplit(".", 1)[0] + '.merged'
+        # double episodes have 2 screenplays concatenated: split their alignment into segments between anchors.
+        is_double_episode = bool(re.search(r'E\d+E\d+', self.filename))
         data_merger.run(self.temp_files['formatted_screenplay'], self.temp_files['subtitles'],
-                        self.temp_files['laughter_times'], merged_filename)
+                        self.temp_files['laughter_times'], merged_filename, anchored=is_double_episode,
+                        processes=self.processes)
 
     def _cleanup(self):
         for key, filename in self.temp_files.items():
@@ -194,10 +444,24 @@ class MergeException(Exception):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Process 1 episode video file and create a .merged corpus file.")
     parser.add_argument('video_file', help='Path to the video file')
+    parser.add_argument('--stream-audio', action='store_true',
+                        help="Pipe the audio from ffmpeg instead of writing temporary .wav files.")
+    parser.add_argument('--keep-audio', action='store_true',
+                        help="Write the intermediate .wav files and keep them (for debugging).")
+    parser.add_argument('--audio-profile', choices=['full', 'reduced'], default=AUDIO_PROFILE,
+                        help="'reduced' (opt-in) resamples the audio to the lowest rate the dB envelopes need. It may "
+                             "shift laugh times and sync measures slightly (see tests/test_audio_profiles.py).")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Run all of the stages, instead of reusing the cached outputs of unchanged stages.")
+    parser.add_argument('--processes', type=int,
+                        help="Number of processes for merging a double episode (default: the number of CPUs).")
+    parser.add_argument('--keep-merge-inputs', action='store_true',
+                        help="Keep the .formatted, .srt & .laugh files, for data_merger/batch_merger.py.")
     args = parser.parse_args()
     video_file = args.video_file
 
     if not os.path.exists(video_file):
         print("'%s' illegal path!\n" % episodes_path)
 
-    run(video_file)
+    run(video_file, args.stream_audio, args.keep_audio, args.audio_profile, not args.no_cache, args.processes,
+        args.keep_merge_inputs)
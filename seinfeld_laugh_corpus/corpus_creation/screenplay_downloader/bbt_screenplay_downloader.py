@@ -6,7 +6,7 @@ import re
 import requests
 from bs4 import BeautifulSoup
 
-from seinfeld_laugh_corpus.corpus_creation.screenplay_downloader.screenplay_downloader import ScreenplayDownloader
+from .screenplay_downloader import ScreenplayDownloader
 
 
 def run(input_filename, output_filename):
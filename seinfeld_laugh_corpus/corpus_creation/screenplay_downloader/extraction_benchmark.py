@@ -0,0 +1,90 @@
+"""
+Benchmarks the extraction of the screenplay text from saved pages, parsing the whole page vs. parsing only the
+screenplay's subtree (see _extract_screenplay_text() of the show-specific downloaders), and checks that both return the
+same text.
+
+The pages are read from the screenplays cache (see http_client), or from a folder of saved pages of one show.
+"""
+import argparse
+import json
+import os
+from timeit import default_timer as timer
+
+from config import SCREENPLAYS_CACHE_PATH
+from screenplay_downloader.friends_screenplay_downloader import FriendsScreenplayDownloader
+from screenplay_downloader.seinfeld_screenplay_downloader import SeinfeldScreenplayDownloader, SEINOLOGY_SCRIPTS_URL
+
+DOWNLOADERS = {'seinfeld': SeinfeldScreenplayDownloader, 'friends': FriendsScreenplayDownloader}
+SITES = {'seinfeld': SEINOLOGY_SCRIPTS_URL, 'friends': FriendsScreenplayDownloader.friends_scripts_url}
+
+
+def run(directory=None, show_name=None, repeat=3):
+    if directory:
+        pages = {show_name: get_pages_in_directory(directory)}
+    else:
+        pages = get_cached_pages()
+
+    for show_name, show_pages in sorted(pages.items()):
+        if not show_pages:
+            continue
+        extract = DOWNLOADERS[show_name]._extract_screenplay_text
+        mismatches = sum(extract(page, restricted_parse=True) != extract(page, restricted_parse=False)
+                         for page in show_pages)
+        print("%s: %d pages, %d with different text." % (show_name, len(show_pages), mismatches))
+        for restricted_parse in (False, True):
+            seconds = measure(extract, show_pages, restricted_parse, repeat)
+            print("    %s parse: %.1f pages/second" % ("restricted" if restricted_parse else "full",
+                                                       len(show_pages) / seconds))
+
+
+def measure(extract, pages, restricted_parse, repeat):
+    """
+    :return: The best time (in seconds) of extracting the text of all of the pages.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = timer()
+        for page in pages:
+            extract(page, restricted_parse=restricted_parse)
+        best = min(best, timer() - start)
+    return best
+
+
+def get_cached_pages():
+    """
+    :return: A dict of the form {show_name: [page content, ...]} of the screenplay pages in the cache.
+    """
+    pages = {show_name: [] for show_name in DOWNLOADERS}
+    if not os.path.isdir(SCREENPLAYS_CACHE_PATH):
+        return pages
+    for filename in sorted(os.listdir(SCREENPLAYS_CACHE_PATH)):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(SCREENPLAYS_CACHE_PATH, filename), encoding='utf-8') as f:
+            metadata = json.load(f)
+        show_name = next((name for name, url in SITES.items() if metadata['url'].startswith(url)), None)
+        if show_name:
+            with open(os.path.join(SCREENPLAYS_CACHE_PATH, 'bodies', metadata['sha1']), 'rb') as f:
+                pages[show_name].append(f.read())
+    return pages
+
+
+def get_pages_in_directory(directory):
+    pages = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(('.html', '.htm', '.shtml')):
+            with open(os.path.join(directory, filename), 'rb') as f:
+                pages.append(f.read())
+    return pages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the extraction of screenplays from saved pages.")
+    parser.add_argument('--directory', help="A folder of saved pages of one show (default: the screenplays cache).")
+    parser.add_argument('--show', choices=sorted(DOWNLOADERS), help="The show of the pages in the folder.")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.directory and not args.show:
+        parser.error("--directory requires --show")
+    run(args.directory, args.show, args.repeat)
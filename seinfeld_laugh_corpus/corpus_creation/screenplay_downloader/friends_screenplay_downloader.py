@@ -4,9 +4,9 @@ This is a crawler that downloads 'friends' screenplays.
 import re
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
-from seinfeld_laugh_corpus.corpus_creation.screenplay_downloader.screenplay_downloader import ScreenplayDownloader
+from .screenplay_downloader import ScreenplayDownloader
 
 
 def run(input_filename, output_filename):
@@ -21,21 +21,29 @@ class FriendsScreenplayDownloader(ScreenplayDownloader):
         screenplay_url = self._get_screenplay_url(season_num, episode_num)
         url_content = self._get_content(screenplay_url)
 
-        # get text
-        soup = BeautifulSoup(url_content, 'lxml')
+        result = self._extract_screenplay_text(url_content)
+
+        if is_double_episode:
+            return [result, self._download_screenplay(season_num, episode_num + 1, False)[0]]
+        else:
+            return [result]
+
+    @staticmethod
+    def _extract_screenplay_text(content, restricted_parse=True):
+        """
+        :param content: The HTML of a screenplay page.
+        :param restricted_parse: Build only the <hr> & <p> tags instead of the whole page (same result, faster).
+        :return: The text of the screenplay: the paragraphs after the header.
+        """
+        parse_only = SoupStrainer(["hr", "p"]) if restricted_parse else None
+        soup = BeautifulSoup(content, 'lxml', parse_only=parse_only)
         try:
             header = soup.find_all("hr", limit=2)[-1]
         except IndexError:
             header = soup.find("p", class_="scene")
         s = header.find_all_next("p")
         s = [tag for tag in s if not ('align' in tag.attrs or 'class' in tag.attrs)]
-        screenplay_txt = "\n".join((line.get_text() for line in s if "transcribed by:" not in line.get_text().lower()))
-        result = screenplay_txt
-
-        if is_double_episode:
-            return [result, self._download_screenplay(season_num, episode_num + 1, False)[0]]
-        else:
-            return [result]
+        return "\n".join((line.get_text() for line in s if "transcribed by:" not in line.get_text().lower()))
 
     def _get_screenplay_url(self, season_num, episode_num):
         return self.friends_scripts_url + "%02d%02d.html" % (season_num, episode_num)
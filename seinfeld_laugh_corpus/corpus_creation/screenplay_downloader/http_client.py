@@ -0,0 +1,196 @@
+"""
+The HTTP layer of the screenplay downloaders: pooled keep-alive connections, timeouts, bounded retries with exponential
+backoff, and a persistent on-disk cache.
+
+Every fetched page is saved in the cache (its body is stored under the SHA-1 of its content) along with its ETag &
+Last-Modified headers, so fetching it again only revalidates it with the server (if the server can't be reached or keeps
+returning errors, the cached page is used). A page that was fetched or revalidated less than SCREENPLAYS_FRESHNESS
+seconds ago is served from the cache without asking the server at all, and so is the error of a page that wasn't found
+(e.g. the page of an episode that is half of a double episode, whose screenplay is on one page). In offline mode pages
+are served from the cache only, so corpus rebuilds don't depend on the remote sites at all.
+"""
+import hashlib
+import json
+import os
+import threading
+from time import sleep, monotonic, time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import SCREENPLAYS_CACHE_PATH, OFFLINE_MODE, SCREENPLAYS_FRESHNESS
+from utils import atomic_file
+
+TIMEOUT = (10, 30)          # seconds (connect, read).
+MAX_RETRIES = 4
+BACKOFF = 1                 # seconds to wait before the first retry (doubled on every retry).
+MAX_BACKOFF = 30
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+POOL_SIZE = 8
+
+offline = OFFLINE_MODE
+_local = threading.local()  # a session per thread, each with its own connection pool.
+_rate_limit = {'interval': 0, 'next_request': 0}    # the requests of all threads are spaced by 'interval' seconds.
+_rate_limit_lock = threading.Lock()
+
+
+def set_offline(is_offline):
+    """
+    :param is_offline: If True, pages are served from the cache only.
+    """
+    global offline
+    offline = is_offline
+
+
+def set_rate_limit(requests_per_second):
+    """
+    :param requests_per_second: The maximal rate of requests to the servers (of all threads), or None for no limit.
+    """
+    _rate_limit['interval'] = 1 / requests_per_second if requests_per_second else 0
+
+
+def get(url):
+    """
+    :param url: The URL of a page.
+    :return: The body of the page (bytes), from the cache if it's fresh or hasn't changed.
+    :raise requests.RequestException: if the page isn't cached and the server returned an error or couldn't be reached
+                                      (or, in offline mode, if the page isn't cached).
+    """
+    cached = _load(url)
+    if cached is not None and (offline or _is_fresh(cached[0])):
+        return cached[1]
+    if offline:
+        raise requests.HTTPError("'%s' isn't cached (offline mode)." % url)
+    failure = _load_failure(url)
+    if failure is not None and _is_fresh(failure):
+        raise requests.HTTPError("Status code isn't 200 (%d) for '%s' (cached)" % (failure['status'], url))
+
+    headers = {}
+    if cached is not None:
+        metadata = cached[0]
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+
+    try:
+        response = _request(url, headers)
+    except requests.RequestException as e:
+        # e.g. the site is down, or still returns errors after the retries.
+        if cached is None:
+            if isinstance(e, requests.HTTPError) and e.response is not None and \
+                    e.response.status_code not in RETRY_STATUS_CODES:
+                _save_failure(url, e.response.status_code)
+            raise
+        print("Warning: could not revalidate '%s' (%s). Using the cached page." % (url, str(e)))
+        return cached[1]
+
+    if response.status_code == 304 and cached is not None:
+        _save_metadata(url, dict(cached[0], time=time()))
+        return cached[1]
+    _save(url, response)
+    return response.content
+
+
+def _request(url, headers):
+    backoff = BACKOFF
+    for retry_num in range(MAX_RETRIES + 1):
+        try:
+            _wait_for_rate_limit()
+            response = _get_session().get(url, headers=headers, timeout=TIMEOUT)
+            if response.status_code in (200, 304):
+                return response
+            if response.status_code not in RETRY_STATUS_CODES or retry_num == MAX_RETRIES:
+                raise requests.HTTPError("Status code isn't 200 (%d) for '%s'" % (response.status_code, url),
+                                         response=response)
+        except (requests.ConnectionError, requests.Timeout):
+            if retry_num == MAX_RETRIES:
+                raise
+        sleep(backoff)
+        backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+def _wait_for_rate_limit():
+    with _rate_limit_lock:
+        now = monotonic()
+        wait = _rate_limit['next_request'] - now
+        _rate_limit['next_request'] = max(now, _rate_limit['next_request']) + _rate_limit['interval']
+    if wait > 0:
+        sleep(wait)
+
+
+def _get_session():
+    if not hasattr(_local, 'session'):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _local.session = session
+    return _local.session
+
+
+def _get_metadata_path(url):
+    return os.path.join(SCREENPLAYS_CACHE_PATH, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+
+def _get_failure_path(url):
+    return os.path.join(SCREENPLAYS_CACHE_PATH, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.failed.json')
+
+
+def _get_body_path(content_hash):
+    return os.path.join(SCREENPLAYS_CACHE_PATH, 'bodies', content_hash)
+
+
+def _load(url):
+    """
+    :return: A tuple (metadata, body) of the cached page, or None if it isn't cached.
+    """
+    try:
+        with open(_get_metadata_path(url), encoding='utf-8') as f:
+            metadata = json.load(f)
+        with open(_get_body_path(metadata['sha1']), 'rb') as f:
+            return metadata, f.read()
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _load_failure(url):
+    """
+    :return: A dict of the status code & time of the last failed request of the page, or None if there is none.
+    """
+    try:
+        with open(_get_failure_path(url), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_fresh(metadata):
+    return time() - metadata.get('time', 0) < SCREENPLAYS_FRESHNESS
+
+
+def _save(url, response):
+    content_hash = hashlib.sha1(response.content).hexdigest()
+    try:
+        if not os.path.exists(_get_body_path(content_hash)):
+            atomic_file.write(_get_body_path(content_hash), response.content)
+    except OSError as e:
+        print("Warning: could not cache '%s' (%s)." % (url, str(e)))
+        return
+    _save_metadata(url, {'url': url, 'sha1': content_hash, 'time': time(), 'etag': response.headers.get('ETag'),
+                         'last_modified': response.headers.get('Last-Modified')})
+
+
+def _save_metadata(url, metadata):
+    try:
+        atomic_file.write(_get_metadata_path(url), json.dumps(metadata).encode('utf-8'))
+    except OSError as e:
+        print("Warning: could not cache '%s' (%s)." % (url, str(e)))
+
+
+def _save_failure(url, status_code):
+    try:
+        atomic_file.write(_get_failure_path(url),
+                          json.dumps({'url': url, 'status': status_code, 'time': time()}).encode('utf-8'))
+    except OSError as e:
+        print("Warning: could not cache the failure of '%s' (%s)." % (url, str(e)))
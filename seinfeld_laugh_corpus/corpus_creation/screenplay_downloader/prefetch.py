@@ -0,0 +1,148 @@
+"""
+Prefetches the screenplays of many episodes concurrently (under a rate limit), so they're in the HTTP cache (see
+http_client) before the episodes are processed, and the network isn't on each episode's critical path.
+
+The episodes are either a range of seasons (for shows whose downloader defines EPISODES_PER_SEASON) or the video files
+in a folder.
+"""
+import argparse
+import importlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+from screenplay_downloader import http_client
+
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.avi')
+
+
+def run(show_name, seasons=None, directory=None, threads=4, requests_per_second=2):
+    downloader_module = importlib.import_module(".%s_screenplay_downloader" % show_name,
+                                                package='screenplay_downloader')
+    downloader = getattr(downloader_module, "%sScreenplayDownloader" % show_name.title())()
+
+    if directory:
+        episodes = get_episodes_in_directory(directory)
+    else:
+        episodes_per_season = getattr(downloader_module, 'EPISODES_PER_SEASON', None)
+        if episodes_per_season is None:
+            raise Exception("The number of episodes per season of '%s' is unknown, prefetch a folder instead."
+                            % show_name)
+        episodes = get_episodes_in_seasons(episodes_per_season, seasons or range(1, len(episodes_per_season) + 1))
+
+    print("Prefetching %d screenplays..." % len(episodes))
+    start = timer()
+    failures = prefetch(downloader, episodes, threads, requests_per_second)
+    print("Prefetched %d screenplays in %.1f seconds. %d failed." %
+          (len(episodes) - len(failures), timer() - start, len(failures)))
+    for episode in failures:
+        print("FAILED: '%s'" % episode)
+
+
+def prefetch(downloader, episodes, threads=4, requests_per_second=2):
+    """
+    Downloads & cleans up the screenplays of the episodes (which warms the cache).
+    :param downloader: A ScreenplayDownloader object.
+    :param episodes: A list of episode names in the format S[int]E[int] (or S[int]E[int]E[int] for double episodes).
+    :param threads: Number of concurrent downloads.
+    :param requests_per_second: The maximal rate of requests to the server.
+    :return: A list of the episodes that failed.
+    """
+    http_client.set_rate_limit(requests_per_second)
+    futures = {}
+    try:
+        with ThreadPoolExecutor(threads) as executor:
+            for episode in episodes:
+                season_num, episode_num, _ = downloader._parse_input_filename(episode)
+                previous = futures.get("S%02dE%02d" % (season_num, episode_num - 1))
+                futures[_get_episode_keys(downloader, episode)[0]] = executor.submit(prefetch_episode, downloader,
+                                                                                     episode, previous)
+            covered = set().union(*(future.result() for future in futures.values()))
+    finally:
+        http_client.set_rate_limit(None)
+    # the second half of a double episode is covered by the first half's screenplay.
+    return [episode for episode in episodes if _get_episode_keys(downloader, episode)[0] not in covered]
+
+
+def prefetch_episode(downloader, episode, previous=None):
+    """
+    :param previous: The future of the prefetch of the previous episode, or None if it isn't prefetched.
+    :return: A set of the episodes (see _get_episode_keys()) that the fetched screenplay covers, empty if it failed.
+    """
+    try:
+        downloader.get_screenplay(episode)
+    except Exception as e:
+        season_num, episode_num, is_double_episode = downloader._parse_input_filename(episode)
+        if is_double_episode:
+            print("Couldn't prefetch '%s': %s" % (episode, str(e)))
+            return set()
+        # a season listing doesn't tell which episodes are double: this one may be the second half of the previous one
+        # (which was submitted before it, so waiting for it can't deadlock the threads)...
+        if previous is not None and _get_episode_keys(downloader, episode)[0] in previous.result():
+            return set()
+        # ... or the first half of the next one.
+        episode = "S%02dE%02dE%02d" % (season_num, episode_num, episode_num + 1)
+        try:
+            downloader.get_screenplay(episode)
+        except Exception:
+            print("Couldn't prefetch '%s': %s" % (episode, str(e)))
+            return set()
+    print("Prefetched '%s'." % episode)
+    return set(_get_episode_keys(downloader, episode))
+
+
+def _get_episode_keys(downloader, episode):
+    """
+    :return: A list of the names (in the format S[int]E[int]) of the episodes in the given episode's video.
+    """
+    season_num, episode_num, is_double_episode = downloader._parse_input_filename(episode)
+    episode_nums = [episode_num, episode_num + 1] if is_double_episode else [episode_num]
+    return ["S%02dE%02d" % (season_num, n) for n in episode_nums]
+
+
+def get_episodes_in_seasons(episodes_per_season, seasons):
+    """
+    :param episodes_per_season: A list of the number of episodes in every season.
+    :param seasons: An iterable of season numbers (starting from 1).
+    :return: A list of episode names in the format S[int]E[int].
+    """
+    return ["S%02dE%02d" % (season, episode)
+            for season in seasons for episode in range(1, episodes_per_season[season - 1] + 1)]
+
+
+def get_episodes_in_directory(directory):
+    """
+    :return: The names of the video files in the directory (and its subdirectories) that have season & episode numbers.
+    """
+    episodes = []
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(VIDEO_EXTENSIONS) and re.search(r'S\d+E\d+', filename, re.IGNORECASE):
+                episodes.append(filename)
+    return episodes
+
+
+def parse_seasons(seasons):
+    """
+    :param seasons: A range of seasons, e.g. '3', '2-5' or '1,3,7-9'.
+    :return: A list of season numbers.
+    """
+    result = []
+    for part in seasons.split(','):
+        first, _, last = part.partition('-')
+        result.extend(range(int(first), int(last or first) + 1))
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prefetch the screenplays of many episodes into the cache.")
+    parser.add_argument('show_name', help="'seinfeld', 'friends' or 'bbt'.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--seasons', type=parse_seasons, help="A range of seasons, e.g. '1-9' (default: all of them).")
+    group.add_argument('--directory', help="A folder of video files, e.g. 'Seinfeld.S04E07.The.Bubble.Boy.mkv'.")
+    parser.add_argument('--threads', type=int, default=4, help="Number of concurrent downloads.")
+    parser.add_argument('--rate', type=float, default=2, help="Maximal number of requests per second.")
+    args = parser.parse_args()
+
+    run(args.show_name, args.seasons, args.directory, args.threads, args.rate)
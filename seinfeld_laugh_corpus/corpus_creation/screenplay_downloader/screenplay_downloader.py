@@ -3,8 +3,7 @@ This is a crawler that downloads screenplays from 'seinology.com' given the seas
 """
 import re
 
-import requests
-from bs4 import BeautifulSoup
+from screenplay_downloader import http_client
 
 MIN_LENGTH = 13000  # if the screenplay has less characters, something is probably wrong.
 
@@ -23,6 +22,13 @@ class ScreenplayDownloader:
         :param output_filename: Output will be written to this file.
         :return:
         """
+        self._write_to_file(self.get_screenplay(input_filename), output_filename)
+
+    def get_screenplay(self, input_filename):
+        """
+        :param input_filename: The .mkv filename. Must contain season & episode numbers in the format S[int]E[int].
+        :return: The cleaned up screenplay of the episode.
+        """
         result = ""
         season_num, episode_num, is_double_episode = self._parse_input_filename(input_filename)
         screenplay_txts = self._download_screenplay(season_num, episode_num, is_double_episode)
@@ -31,7 +37,7 @@ class ScreenplayDownloader:
                 raise Exception("Something seems of with the screenplay. It's too short. Please check this manually.")
             screenplay_txt = self._cleanup(screenplay_txt)
             result += screenplay_txt + '\n'
-        self._write_to_file(result, output_filename)
+        return result
 
     @staticmethod
     def _parse_input_filename(input_filename):
@@ -57,16 +63,10 @@ class ScreenplayDownloader:
 
     @staticmethod
     def _get_content(screenplay_url):
-        retry_num = 0
-        while True:
-            r = requests.get(screenplay_url)
-            if r.status_code == 200:
-                break
-            else:
-                if retry_num > 3:
-                    raise requests.HTTPError("Status code isn't 200")
-                retry_num += 1
-        return r.content
+        """
+        :return: The content of the page (see http_client.get()).
+        """
+        return http_client.get(screenplay_url)
 
     @staticmethod
     def _capitalize_all_character_names(lines):
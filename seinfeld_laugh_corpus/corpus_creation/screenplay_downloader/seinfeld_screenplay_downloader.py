@@ -4,7 +4,7 @@ This is a crawler that downloads screenplays from 'seinology.com' given the seas
 import re
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from .screenplay_downloader import ScreenplayDownloader
 
@@ -22,31 +22,34 @@ class SeinfeldScreenplayDownloader(ScreenplayDownloader):
     def _download_screenplay(self, season_num, episode_num, is_double_episode):
         screenplay_url = self._get_screenplay_url(season_num, episode_num)
 
-        retry_num = 0
-        while True:
-            r = requests.get(screenplay_url)
-            if r.status_code == 200:
-                break
-            else:
-                if is_double_episode:
-                    screenplay_url = self._get_screenplay_url_double_episode(season_num, episode_num)
-                    is_double_episode = False  # Some episodes are split in the website, but not in the DVD, and vice versa.
-                if retry_num > 3:
-                    raise requests.HTTPError("Status code isn't 200")
-                retry_num += 1
+        try:
+            content = self._get_content(screenplay_url)
+        except requests.HTTPError:
+            if not is_double_episode:
+                raise
+            screenplay_url = self._get_screenplay_url_double_episode(season_num, episode_num)
+            is_double_episode = False  # Some episodes are split in the website, but not in the DVD, and vice versa.
+            content = self._get_content(screenplay_url)
 
-        # get text
-        soup = BeautifulSoup(r.content, 'html.parser')
-        s = soup.find("td", class_="spacer2")
-        screenplay_txt = s.get_text()
         # TODO clean up txt for formatting
-        result = screenplay_txt
+        result = self._extract_screenplay_text(content)
 
         if is_double_episode:
             return [result, self._download_screenplay(season_num, episode_num + 1, False)[0]]
         else:
             return [result]
 
+    @staticmethod
+    def _extract_screenplay_text(content, restricted_parse=True):
+        """
+        :param content: The HTML of a screenplay page.
+        :param restricted_parse: Build only the screenplay's subtree instead of the whole page (same result, faster).
+        :return: The text of the screenplay.
+        """
+        parse_only = SoupStrainer("td", class_="spacer2") if restricted_parse else None
+        soup = BeautifulSoup(content, 'html.parser', parse_only=parse_only)
+        return soup.find("td", class_="spacer2").get_text()
+
     @staticmethod
     def _get_screenplay_url(season_num, episode_num):
         page_number = episodes_per_season_commulative[season_num - 1] + episode_num
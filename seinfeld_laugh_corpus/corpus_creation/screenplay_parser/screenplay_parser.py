@@ -4,8 +4,26 @@ By Ran Yad-Shalom
 """
 
 import argparse
+import hashlib
+import inspect
+import json
+import os
 import re
 
+from config import SCREENPLAY_TOKENS_CACHE_PATH
+from utils import atomic_file
+
+# token types
+NEWLINE = 'newline'
+WORD = 'word'
+OPEN_DELIMITER = 'open'         # a word that starts with a left delimiter, e.g. '(laughs)'.
+SCENE_HEADING = 'heading'       # a word that starts with a scene heading prefix, e.g. 'INT.'.
+COMMENT = 'comment'             # a word that starts with '%'.
+# the methods that produce the tokens: their source is part of the key of cached tokens (tweaks to the rest of the
+# parser, e.g. to _process, keep the cached tokens).
+TOKENIZER_METHODS = ('_preprocess', '_get_patterns', '_tokenize', '_get_token', '_word_has_parenthesis_inside',
+                     '_split_word_with_parenthesis')
+
 
 class ScreenplayParser:
     """
@@ -25,65 +43,121 @@ class ScreenplayParser:
     def run(self, src, dst):
         return self.to_file(src, dst)
 
-    def to_file(self, src, dst):
+    def to_file(self, src, dst, cache_tokens=True):
         """
         Parses a given screenplay and writes the output to dst.
         :param src: Path of a raw screenplay from the Internet.
         :param dst: Path of the output file
+        :param cache_tokens: If True, the tokens of the screenplay are cached (see tokenize()).
         """
         with open(src, encoding='utf8', errors='ignore') as f:
             screenplay_as_str = f.read()
 
-        result = self.parse_screenplay(screenplay_as_str)
+        result = self.parse_screenplay(screenplay_as_str, cache_tokens)
         print("Success! Writing to file '%s'..." % dst)
 
         with open(dst, 'w', encoding='utf8', errors='ignore') as f:
             f.write(result)
 
-    def parse_screenplay(self, screenplay_as_str):
+    def parse_screenplay(self, screenplay_as_str, cache_tokens=False):
         """
         Try to think of the reformatted as a DFA. We scan the screenplay only once, while each word will be processed
         by a node according to the rules layed out before.
         :param screenplay_as_str:
+        :param cache_tokens: If True, the tokens of the screenplay are cached (see tokenize()).
         :return: a newly formatted screenplay
         """
-        screenplay_as_str = self._preprocess(screenplay_as_str)
-        words_generator = self._get_words_generator(screenplay_as_str)
-        word = next(words_generator)
-        return self._process(words_generator)
-
-    def _get_words_generator(self, screenplay_as_str):
-        for line in screenplay_as_str.split('\n'):
-            yield '\n'
-            for word in line.split():
-                if self._word_has_parenthesis_inside(word):
-                    word_a, word_b = split_word_with_parenthesis(word)
-                    yield word_a
-                    yield word_b
-                else:
-                    # break word and yield before and after delimiter
-                    # TODO solve this issue in the "process parenthesis" and "process character" combination
-                    yield word
+        tokens = iter(self.tokenize(screenplay_as_str, cache_tokens))
+        token = next(tokens)
+        return self._process(tokens)
 
-    @staticmethod
-    def _word_has_parenthesis_inside(word):
-        proper_length = len(word) > 2
-        has_delimiter = any((d in word[1:-1]) for d in delimiters)
-        splitted = re.split("|".join("\\"+d for d in delimiters), word)
-        is_letters = lambda w: any(c.isalpha() for c in w)
-        has_ascii_after_split = all(is_letters(w) for w in splitted)
+    def tokenize(self, screenplay_as_str, use_cache=False):
+        """
+        Splits the (preprocessed) screenplay to typed tokens: a NEWLINE token at the beginning of every line, followed
+        by the line's words (SCENE_HEADING, OPEN_DELIMITER, COMMENT or WORD tokens).
+        :param screenplay_as_str: A raw screenplay.
+        :param use_cache: If True, the tokens are loaded from (or saved to) SCREENPLAY_TOKENS_CACHE_PATH, keyed by a
+                          hash of the screenplay, of the tokenizer's settings and of its code.
+        :return: A list of (token type, text) tuples.
+        """
+        if not use_cache:
+            return self._tokenize(self._preprocess(screenplay_as_str))
 
-        return proper_length and has_delimiter and has_ascii_after_split
+        cache_path = self._get_tokens_cache_path(screenplay_as_str)
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                return [tuple(token) for token in json.load(f)]
+        except (OSError, ValueError):
+            pass
+        tokens = self._tokenize(self._preprocess(screenplay_as_str))
+        try:
+            atomic_file.write(cache_path, json.dumps(tokens).encode('utf-8'))
+        except OSError as e:
+            print("Warning: could not cache the screenplay's tokens (%s)." % str(e))
+        return tokens
 
-    @staticmethod
-    def _split_word_with_parenthesis(word):
-        for l in word:
-            if delimiters_dict.get(l, ''):
-                # left delimiter is inside the word
-                return word.split(l)[0], l + word.split(l)[1]
-            if l in delimiters_dict.values():
-                # right delimiter is inside word
-                return word.split(l)[0] + l, word.split(l)[1]
+    def _get_tokens_cache_path(self, screenplay_as_str):
+        settings = (NEWLINE, WORD, OPEN_DELIMITER, SCENE_HEADING, COMMENT, sorted(self.delimiters_dict.items()),
+                    sorted(self.delimiters), list(self.scene_headings))
+        h = hashlib.sha1(repr(settings).encode('utf-8'))
+        for name in TOKENIZER_METHODS:
+            # the methods as the parser's class resolves them, so a subclass that overrides one changes the key.
+            h.update(inspect.getsource(getattr(type(self), name)).encode('utf-8'))
+        h.update(screenplay_as_str.encode('utf-8', errors='ignore'))
+        return os.path.join(SCREENPLAY_TOKENS_CACHE_PATH, "%s.json" % h.hexdigest())
+
+    @classmethod
+    def _get_patterns(cls):
+        """
+        The regular expressions of the tokenizer are compiled once per parser class (they depend on its delimiters
+        and scene headings).
+        :return: A tuple (master pattern, delimiters pattern).
+        """
+        if '_patterns' not in cls.__dict__:
+            master = "|".join([r"(?P<%s>\n)" % NEWLINE,
+                               r"(?P<%s>(?:%s)\S*)" % (SCENE_HEADING, "|".join(map(re.escape, cls.scene_headings))),
+                               r"(?P<%s>[%s]\S*)" % (OPEN_DELIMITER, "".join(map(re.escape, cls.delimiters_dict))),
+                               r"(?P<%s>%%\S*)" % COMMENT,
+                               r"(?P<%s>\S+)" % WORD])
+            delimiters = "[%s]" % "".join(map(re.escape, sorted(cls.delimiters)))
+            cls._patterns = re.compile(master), re.compile(delimiters)
+        return cls._patterns
+
+    def _tokenize(self, screenplay_as_str):
+        master_pattern, _ = self._get_patterns()
+        tokens = [(NEWLINE, '\n')]
+        for match in master_pattern.finditer(screenplay_as_str):
+            token_type, word = match.lastgroup, match.group()
+            if token_type != NEWLINE and self._word_has_parenthesis_inside(word):
+                # break word and yield before and after delimiter
+                # TODO solve this issue in the "process parenthesis" and "process character" combination
+                word_a, word_b = self._split_word_with_parenthesis(word)
+                tokens.append(self._get_token(word_a))
+                tokens.append(self._get_token(word_b))
+            else:
+                tokens.append((token_type, word))
+        return tokens
+
+    def _get_token(self, word):
+        master_pattern, _ = self._get_patterns()
+        return master_pattern.match(word).lastgroup, word
+
+    def _word_has_parenthesis_inside(self, word):
+        # cheapest checks first: most words are short or have no delimiter at all.
+        _, delimiters_pattern = self._get_patterns()
+        if len(word) <= 2 or not delimiters_pattern.search(word, 1, len(word) - 1):
+            return False
+        return all(any(c.isalpha() for c in w) for w in delimiters_pattern.split(word))
+
+    def _split_word_with_parenthesis(self, word):
+        _, delimiters_pattern = self._get_patterns()
+        l = delimiters_pattern.search(word).group()
+        before, after = word.split(l)[:2]
+        if l in self.delimiters_dict:
+            # left delimiter is inside the word
+            return before, l + after
+        # right delimiter is inside word
+        return before + l, after
 
     @staticmethod
     def _preprocess(screenplay):
@@ -97,60 +171,77 @@ class ScreenplayParser:
 
         return screenplay
 
-    def _process(self, words_generator):
-        result = ""
-        word = next(words_generator)
-        while True:
-            try:
-                if word == '\n':
-                    result += word
-                    word = next(words_generator)
+    def _process(self, tokens):
+        # the output is collected in a list of strings (joined once at the end), so every word is copied only once.
+        result = []
+        token_type, word = next(tokens)
+        try:
+            while True:
+                if token_type == NEWLINE:
+                    result.append(word)
+                    token_type, word = next(tokens)
                     if self._is_character(word):
                         # character can only appear after '\n'
-                        block, word = self._process_character_block(word, words_generator)
-                        result = result + block + '\n'
-                elif self._is_scene_heading(word):
-                    result = result[:-1] + self._process_scene_heading(word, words_generator)
-                    result += "\n** NEW SCENE **"
-                    word = next(words_generator)
-                elif self._is_parenthesis(word):
-                    result += '\n' + self._process_parenthesis(word, words_generator)
-                    word = next(words_generator)
-                elif self._is_comment(word):
-                    result += '\n' + self._process_scene_heading(word, words_generator)
-                    word = next(words_generator)
+                        block, (token_type, word) = self._process_character_block(word, tokens)
+                        result.append(block + '\n')
+                elif token_type == SCENE_HEADING:
+                    self._remove_last_character(result)
+                    result.append(self._process_scene_heading(word, tokens))
+                    result.append("\n** NEW SCENE **")
+                    token_type, word = next(tokens)
+                elif token_type == OPEN_DELIMITER:
+                    result.append('\n' + self._process_parenthesis(word, tokens))
+                    token_type, word = next(tokens)
+                elif token_type == COMMENT:
+                    result.append('\n' + self._process_scene_heading(word, tokens))
+                    token_type, word = next(tokens)
                 else:
-                    result += word + ' '
-                    word = next(words_generator)
-            except StopIteration:
-                return result
+                    result.append(word + ' ')
+                    token_type, word = next(tokens)
+        except StopIteration:
+            return "".join(result)
+
+    @staticmethod
+    def _remove_last_character(result):
+        """
+        Removes the last character of the output collected so far (a list of strings).
+        """
+        while result and not result[-1]:
+            result.pop()
+        if result:
+            result[-1] = result[-1][:-1]
 
-    def _process_character_block(self, word, word_generator):
-        block = self._process_character_name(word, word_generator)
+    def _process_character_block(self, word, tokens):
+        """
+        :return: A tuple (the character's name & dialog, the token that ended it).
+        """
+        block = [self._process_character_name(word, tokens)]
         while True:
-            word = next(word_generator)
-            if self._is_parenthesis(word) or self._is_scene_heading(word):
-               return block, word
-            if word == '\n':
-                return block, word
-            else:
-                block += (word + ' ')
+            token = next(tokens)
+            if token[0] in (OPEN_DELIMITER, SCENE_HEADING, NEWLINE):
+                return "".join(block), token
+            block.append(token[1] + ' ')
 
-    def _process_character_name(self, current_word, word_generator):
+    def _process_character_name(self, current_word, tokens):
+        """
+        A character name may be a few words long, and ends with ':' (or with a parenthetical).
+        """
+        name = []
         try:
             while True:
                 if current_word[-1] == ':':
-                    return current_word[:-1] + '\n'
-                else:
-                    next_word = next(word_generator)
-                    if self._is_parenthesis(next_word):
-                        return current_word + '\n' + self._process_parenthesis(next_word, word_generator)
-                    else:
-                        return current_word + ' ' + self._process_character_name(next_word, word_generator)
+                    name.append(current_word[:-1] + '\n')
+                    return "".join(name)
+                token_type, next_word = next(tokens)
+                if token_type == OPEN_DELIMITER:
+                    name.append(current_word + '\n' + self._process_parenthesis(next_word, tokens))
+                    return "".join(name)
+                name.append(current_word + ' ')
+                current_word = next_word
         except StopIteration:
             raise ValueError("A character name did not end with ':' as expected. Please check screenplay.")
 
-    def _process_parenthesis(self, word, word_generator, delimiter=None):
+    def _process_parenthesis(self, word, tokens, delimiter=None):
         """
         Process until you reach the right parenthesis. Turn to a comment.
         If you don't reach rhe right parenthesis, throw exception.
@@ -158,42 +249,38 @@ class ScreenplayParser:
         if not delimiter:
             delimiter = word[0]
             word = "# " + word
-        try:
-            if word[-1] == delimiters_dict.get(delimiter, ''):    # the dict returns the reverse delimiter, e.g. ')' for '('.
-                return word + '\n'
-            if word[-2] == delimiters_dict.get(delimiter, ''):
-                return word[:-1] + '\n'
-        except IndexError:
-            pass    # 1 character words like 'I' or 'a'.
+        right_delimiter = self.delimiters_dict.get(delimiter, '')    # e.g. ')' for '('.
+        comment = []
+        while True:
+            try:
+                if word[-1] == right_delimiter:
+                    comment.append(word + '\n')
+                    return "".join(comment)
+                if word[-2] == right_delimiter:
+                    comment.append(word[:-1] + '\n')
+                    return "".join(comment)
+            except IndexError:
+                pass    # 1 character words like 'I' or 'a'.
 
-        try:
-            return word + ' ' + self._process_parenthesis(next(word_generator), word_generator, delimiter)
-        except StopIteration:
-            raise ValueError("Parenthesis weren't closed as expected.\n"
-                                 "Delimiter: %s. Please check screenplay." % delimiter)
+            comment.append(word + ' ')
+            try:
+                word = next(tokens)[1]
+            except StopIteration:
+                raise ValueError("Parenthesis weren't closed as expected.\n"
+                                     "Delimiter: %s. Please check screenplay." % delimiter)
 
     @staticmethod
-    def _process_scene_heading(word, word_generator):
+    def _process_scene_heading(word, tokens):
         # process the whole line as a scene break.
-        result = '# ' + word
-        for word in word_generator:
-            if word == '\n':
+        result = ['# ' + word]
+        for token_type, word in tokens:
+            if token_type == NEWLINE:
                 break
             else:
-                result += ' ' + word
+                result.append(' ' + word)
 
-        return result
+        return "".join(result)
 
     @staticmethod
     def _is_character(word):
        return word.isupper() and len(word) > 2 and word[:-1].replace(".", "").isalpha()
-
-    def _is_scene_heading(self, word):
-        return any(word.startswith(s) for s in self.scene_headings)
-
-    def _is_parenthesis(self, word):
-        return word[0] in self.delimiters_dict.keys()
-
-    @staticmethod
-    def _is_comment(word):
-        return word[0] in ['%']
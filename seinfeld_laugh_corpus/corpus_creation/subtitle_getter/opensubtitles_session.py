@@ -0,0 +1,103 @@
+"""
+A login session with opensubtitles, shared by all of the episodes that are processed in this process (see
+get_session()). The login token is saved on disk along with its expiry time, so other processes (and later runs)
+reuse it instead of logging in again. All of the requests go through one XML-RPC connection.
+"""
+import json
+import os
+import threading
+from time import sleep, time
+
+from pythonopensubtitles.opensubtitles import OpenSubtitles
+
+from config import opensubtitles_credentials, SUBTITLES_CACHE_PATH
+from utils import atomic_file
+
+TOKEN_PATH = os.path.join(SUBTITLES_CACHE_PATH, 'token.json')
+TOKEN_LIFETIME = 10 * 60        # seconds. opensubtitles tokens expire after 15 minutes without requests.
+LOGIN_RETRY = 60                # seconds to wait before the first retry of a failed login (doubled on every retry).
+MAX_LOGIN_ATTEMPTS = 5
+
+_session = None
+
+
+def get_session():
+    """
+    :return: The OpenSubtitlesSession of this process.
+    """
+    global _session
+    if _session is None:
+        _session = OpenSubtitlesSession()
+    return _session
+
+
+class OpenSubtitlesSession:
+    def __init__(self, token_path=TOKEN_PATH):
+        self.ost = OpenSubtitles()
+        self.token_path = token_path
+        self.expires = 0
+        self.lock = threading.Lock()        # the XML-RPC connection can't be shared by threads.
+
+    def search(self, query):
+        """
+        :param query: A dict of opensubtitles search parameters (e.g. 'query', 'season', 'episode').
+        :return: A list of search results (dicts).
+        """
+        with self.lock:
+            self._login()
+            results = self.ost.search_subtitles([query])
+            if results is None and self._status().startswith('401'):
+                # the token has expired (e.g. it was saved by another process that stopped using it).
+                self.expires = 0
+                self._login(reuse_saved_token=False)
+                results = self.ost.search_subtitles([query])
+            if results is None:
+                raise Exception("opensubtitles returned '%s'" % self._status())
+            self._extend_token()
+            return results or []        # opensubtitles returns False when nothing was found
+
+    def _login(self, reuse_saved_token=True):
+        if self.expires > time():
+            return
+        if reuse_saved_token and self._load_token():
+            return
+
+        retry = LOGIN_RETRY
+        for attempt in range(MAX_LOGIN_ATTEMPTS):
+            try:
+                token = self.ost.login(opensubtitles_credentials['user'], opensubtitles_credentials['password'])
+                if not token:
+                    raise Exception("login failed ('%s')" % self._status())
+            except Exception as e:
+                if attempt == MAX_LOGIN_ATTEMPTS - 1:
+                    raise Exception("ERROR getting Opensubtitles token: %s." % str(e))
+                print("ERROR getting Opensubtitles token: %s.\n Retrying in %d seconds..." % (str(e), retry))
+                sleep(retry)
+                retry *= 2  # exponential backoff
+            else:
+                self._extend_token()
+                return
+
+    def _load_token(self):
+        """
+        :return: True if a valid token was loaded from the disk, False otherwise.
+        """
+        try:
+            with open(self.token_path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get('expires', 0) <= time():
+            return False
+        self.ost.token, self.expires = saved['token'], saved['expires']
+        return True
+
+    def _extend_token(self):
+        self.expires = time() + TOKEN_LIFETIME
+        try:
+            atomic_file.write(self.token_path, json.dumps({'token': self.ost.token, 'expires': self.expires}).encode())
+        except OSError as e:
+            print("Warning: could not save the opensubtitles token (%s)." % str(e))
+
+    def _status(self):
+        return str(getattr(self.ost, 'data', None) and self.ost.data.get('status') or '')
@@ -1,56 +1,94 @@
 import gzip
+import json
 import ntpath
 import os
+import random
 import re
+import shutil
 import subprocess
 import sys
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import sleep, time
 
-import pysrt
 import requests
-from numpy import mean, array_split, array, std, sqrt, isinf
-from pythonopensubtitles.opensubtitles import OpenSubtitles
+from numpy import mean, std, isinf, array, arange, argmax, where, maximum, minimum, zeros, flatnonzero, cumsum, add, \
+    sqrt
 from scipy.io.wavfile import read
+from scipy.signal import correlate
 
 sys.path.insert(0, '..')
 sys.path.insert(0, '.')
 
-from corpus_creation.config import opensubtitles_credentials, FFMPEG_PATH
-from corpus_creation.utils.utils import log10wrapper
+from config import FFMPEG_PATH, SUBTITLES_CACHE_PATH
+from subtitle_getter import opensubtitles_session
+from utils import atomic_file, envelope, srt_reader
 
 
-def run(episode_video, episode_audio, output, show='Seinfeld'):
-    subtitle_getter = SubtitleGetter(show=show)
-    subtitle_getter.get_subtitles(episode_video, episode_audio, output)
+def run(episode_video, episode_audio, output, show='Seinfeld', extract_subtitles=True, resync=True):
+    subtitle_getter = SubtitleGetter(show=show, resync=resync)
+    subtitle_getter.get_subtitles(episode_video, episode_audio, output, extract_subtitles)
 
 
 class SubtitleGetter:
     peak_detection_threshold = 100          # the amplitude difference between 2 sample points to be considered as a peak
     db_measurement_chunks_per_second = 20   # chunks (to measure dB of) per second.
-    ost_retry = 60                          # number of seconds to wait before retrying to connect to opensubtitles.
+    download_threads = 3                    # number of subtitles that are downloaded concurrently.
+    download_timeout = (10, 30)             # seconds (connect, read) to wait for the server during a download.
+    download_retries = 3
+    download_retry_interval = 60            # seconds to wait before the first retry (doubled on every retry).
+    search_attempts = 5
+    search_retry_interval = 60              # seconds to wait before the first retry (doubled on every retry).
+    search_cache_lifetime = 7 * 24 * 3600   # seconds until cached search results are searched again.
+    search_results_cap = 500                # opensubtitles returns at most this many results for a search.
+    max_results = 5                         # number of search results whose subtitles are tried.
     sync_threshold = 0.094                  # A float between 0 to 1. The higher the number, the more in-sync the subtitles.
-
-    def __init__(self, show='Seinfeld'):
+    max_resync_offset = 120                 # the maximal offset (in seconds) that resyncing looks for.
+    max_resync_drift = 3                    # the maximal change (in seconds) of the offset in half an episode.
+    resync_scales = (1, 23.976/25, 25/23.976)   # time scales of frame rate conversions (e.g. film to PAL).
+    validation_sample_size = 60             # number of subtitles that are checked by the sampled validation.
+    validation_background_chunks = 400      # number of random chunks that estimate the mean & std of the dB levels.
+    validation_z = 2.58                     # the z-score of the sampled validation's confidence bound (99%).
+
+    def __init__(self, show='Seinfeld', resync=True):
         """
         :param show: the 'show' parameter will be passed to OpenSubtitles API as the query string.
+        :param resync: Try to fix subtitles that are out of sync by shifting & scaling their times (see _resync()),
+                       before dropping them.
         """
         self.show = show
+        self.resync = resync
 
-    def get_subtitles(self, episode_video, episode_audio, output):
-        dbs = self._get_audio_dbs(episode_audio)
+    def get_subtitles(self, episode_video, episode_audio, output, extract_subtitles=True):
+        """
+        :param extract_subtitles: Extract the subtitles from the video if the output file doesn't exist. False if this
+                                  has already been attempted (e.g. along with the audio, by the processor).
+        """
+        dbs = None
         try:
-            if not os.path.exists(output):
+            if os.path.exists(output):
+                print("Using the existing subtitles file.")
+            elif extract_subtitles:
                 self._extract_subtitles_from_mkv(episode_video, output)
             else:
-                print("Using the existing subtitles file.")
-            if self._is_valid(output, dbs):
+                raise NoSubtitlesException()
+            is_valid = self._is_valid_by_sampling(output, episode_audio)
+            if is_valid:
+                return
+            dbs = self._get_audio_dbs(episode_audio)
+            if is_valid is None and self._is_valid(output, dbs):
+                return
+            elif self.resync and self._resync(output, dbs):
                 return
             else:
                 print("Subtitles from .mkv file are not in valid! trying to download...")
+        except NoSubtitlesException:
+            print("The video has no text subtitles. trying to download them...")
         except Exception as e:
             print("Couldn't extract subtitles from .mkv! (%s)\n"
                   "Make sure you have a working version of ffmpeg in the external_tools folder.\n"
                   "trying to download them..." % str(e))
+        if dbs is None:
+            dbs = self._get_audio_dbs(episode_audio)
         self._fetch_subtitles_from_opensubtitles(episode_video, dbs, output)
 
     @staticmethod
@@ -63,83 +101,132 @@ class SubtitleGetter:
                             "that the .mkv file contains text subtitles and not bitmap subtitles." % exit_code)
 
     def _fetch_subtitles_from_opensubtitles(self, episode_video_path, dbs, output):
-        max_results = 5
-        results = self._get_opensubtitles_search_results(episode_video_path)
+        results = self._get_opensubtitles_search_results(episode_video_path)[:self.max_results]
+
+        # the candidates are downloaded concurrently, and each one is scored as soon as it arrives.
+        with ThreadPoolExecutor(self.download_threads) as executor:
+            futures = {executor.submit(self._download_subtitle, result): result for result in results}
+            for future in as_completed(futures):
+                result = futures[future]
+                try:
+                    result['subtitles'] = future.result()
+                    print("Checking if subtitle '%s' is in sync..." % result['SubFileName'])
+                    subs = srt_reader.read(result['subtitles'])
+                    result['sync_measure'] = self._get_sync_measure(subs, dbs)
+                    if result['sync_measure'] < self.sync_threshold and self.resync:
+                        time_shift, resynced_measure = self._get_resynced_measure(subs, dbs)
+                        if resynced_measure > result['sync_measure']:
+                            result['sync_measure'], result['time_shift'] = resynced_measure, time_shift
+                    result['has_enough_dashes'] = self._has_enough_dashes(subs)
+                except Exception as e:
+                    print("ERROR downloading subtitle '%s': %s" % (result['SubFileName'], str(e)))
+
+        # ties go to the higher ranked search result, regardless of the order of the downloads.
         best_result = {'sync_measure': 0}
-
-        for result in results[:max_results]:
-            try:
-                self._download_subtitle(result, output)
-                print("Checking if subtitle '%s' is in sync..." % result['SubFileName'])
-                subs = pysrt.open(output, encoding='ansi ', error_handling='ignore')
-                result['sync_measure'] = self._get_sync_measure(subs, dbs)
-                if result['sync_measure'] > best_result['sync_measure'] and self._has_enough_dashes(subs):
-                    best_result = result
-            except Exception as e:
-                print("ERROR downloading subtitle '%s': %s" % (result['SubFileName'], str(e)))
-                pass
+        for result in results:
+            if result.get('sync_measure', 0) > best_result['sync_measure'] and result.get('has_enough_dashes'):
+                best_result = result
 
         if best_result['sync_measure'] > self.sync_threshold:
-            print("Downloading best synced subtitle...")
-            self._download_subtitle(best_result, output)
+            print("Using best synced subtitle '%s'..." % best_result['SubFileName'])
+            if 'time_shift' in best_result:
+                subs = srt_reader.read(best_result['subtitles'])
+                srt_reader.write(self._shift(subs, *best_result['time_shift'], dbs), output)
+            else:
+                shutil.copyfile(best_result['subtitles'], output)
             return
 
-        raise Exception("Out of %d opensubtitles results, none of them are valid!" % len(results[:max_results]))
+        raise Exception("Out of %d opensubtitles results, none of them are valid!" % len(results))
 
     def _get_opensubtitles_search_results(self, episode_video_path):
-        ost = self._get_open_subtitles_object()
+        """
+        The results are looked up per season (one search for all of its episodes) and cached on disk. An episode that
+        got fewer than max_results of the season's results is searched on its own, and so is every episode of a season
+        whose results were cut off by search_results_cap (its own results come first, followed by the season's).
+        :return: a list of opensubtitles search results for the episode.
+        """
         episode_video = ntpath.basename(episode_video_path)
-        retry = 60
-        # downloading code
         m = re.findall(r'\d+', episode_video)
         se, ep = int(m[0]), int(m[1])
-        while True:
+
+        episode_cache_path = os.path.join(SUBTITLES_CACHE_PATH, 'search', '%s S%02dE%02d.json' % (self.show, se, ep))
+        season_cache_path = os.path.join(SUBTITLES_CACHE_PATH, 'search', '%s S%02d.json' % (self.show, se))
+        if self._is_cached(episode_cache_path):
+            return self._read_json(episode_cache_path)
+        if not self._is_cached(season_cache_path):
+            results = self._search({'query': self.show, 'season': se, 'sublanguageid': 'eng'}) or []
+            results_by_episode = {}
+            for result in results:
+                results_by_episode.setdefault(str(int(result.get('SeriesEpisode') or 0)), []).append(result)
+            season = {'truncated': len(results) >= self.search_results_cap, 'results': results_by_episode}
+            atomic_file.write(season_cache_path, json.dumps(season).encode('utf-8'))
+        season = self._read_json(season_cache_path)
+        season_results = season.get('results', {}).get(str(ep), [])
+        if len(season_results) >= self.max_results and not season.get('truncated', True):
+            return season_results
+
+        results = self._search({'query': self.show, 'episode': ep, 'season': se, 'sublanguageid': 'eng'}) or []
+        subtitle_file_ids = set(result['IDSubtitleFile'] for result in results)
+        results += [result for result in season_results if result['IDSubtitleFile'] not in subtitle_file_ids]
+        if results:
+            atomic_file.write(episode_cache_path, json.dumps(results).encode('utf-8'))
+        return results
+
+    def _is_cached(self, path):
+        """
+        :return: True if the search results file exists and hasn't expired.
+        """
+        try:
+            return time() - os.path.getmtime(path) < self.search_cache_lifetime
+        except OSError:
+            return False
+
+    def _search(self, query):
+        retry = self.search_retry_interval
+        for attempt in range(self.search_attempts):
             try:
-                results = ost.search_subtitles([{'query': self.show,
-                                                 'episode': ep,
-                                                 'season': se,
-                                                 'sublanguageid': 'eng'}])
+                return opensubtitles_session.get_session().search(query)
             except Exception as e:
-                print("Error getting search results from 'opensubtitles'. retrying in %d seconds..." % retry)
+                if attempt == self.search_attempts - 1:
+                    raise Exception("ERROR getting search results from 'opensubtitles': %s." % str(e))
+                print("Error getting search results from 'opensubtitles' (%s). retrying in %d seconds..." %
+                      (str(e), retry))
                 sleep(retry)
                 retry *= 2
-            else:
-                return results
 
-    def _get_open_subtitles_object(self):
+    @staticmethod
+    def _read_json(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _download_subtitle(self, result):
         """
-        :return: a logged-in OpenSubtitles object.
+        Downloads a subtitle to the cache, unless it's already there.
+        :param result: an opensubtitles search result.
+        :return: the path of the cached .srt file.
         """
-        ost = OpenSubtitles()
-        try:
-            ost_token = ost.login(opensubtitles_credentials['user'], opensubtitles_credentials['password'])
-        except Exception as e:
-            print("ERROR getting Opensubtitles token: %s.\n Retrying in %d seconds..." % (str(e), self.ost_retry))
-            sleep(self.ost_retry)
-            self.ost_retry *= 2  # exponential backoff
-        return ost
+        cache_path = os.path.join(SUBTITLES_CACHE_PATH, '%s.srt' % result['IDSubtitleFile'])
+        if os.path.exists(cache_path):
+            return cache_path
 
-    @staticmethod
-    def _download_subtitle(result, output):
-        retry = 0
-        interval = 60
-
-        url = result['SubDownloadLink']
-        while True:
-            res = requests.get(url)
-            if res.status_code != 200:
-                if retry < 3:
-                    print("Server returned %d: %s. Retrying in %d seconds..." % (res.status_code, res.reason, interval))
-                    retry += 1
-                    sleep(interval)
-                    interval *= 2
-                else:
-                    raise Exception("ERROR: server returned %d: %s" % (res.status_code, res.reason))
-            else:
+        interval = self.download_retry_interval
+        for retry in range(self.download_retries + 1):
+            try:
+                res = requests.get(result['SubDownloadLink'], timeout=self.download_timeout)
+                error = None if res.status_code == 200 else "Server returned %d: %s" % (res.status_code, res.reason)
+            except requests.RequestException as e:
+                error = "Download failed (%s)" % str(e)
+            if error is None:
                 break
+            if retry == self.download_retries:
+                raise Exception("ERROR: %s" % error)
+            print("%s. Retrying in %d seconds..." % (error, interval))
+            sleep(interval)
+            interval *= 2
+
         content = gzip.decompress(res.content)
-        with open(output, 'wb') as f:
-            f.write(content)
+        atomic_file.write(cache_path, content)
+        return cache_path
 
     def _is_valid(self, subtitles, dbs):
         """
@@ -148,7 +235,7 @@ class SubtitleGetter:
         :param dbs: an array of the dB audio levels.
         :return: True if they're valid, False otherwise.
         """
-        subs = pysrt.open(subtitles, encoding='ansi ', error_handling='ignore')
+        subs = srt_reader.read(subtitles)
 
         if not self._has_enough_dashes(subs):
             print("Subtitles don't have enough dashes. Dropping them.")
@@ -158,13 +245,153 @@ class SubtitleGetter:
             return False
         return True
 
+    def _is_valid_by_sampling(self, subtitles, episode_audio):
+        """
+        Checks the validity of the subtitles by measuring only the audio around a random sample of them (and a random
+        sample of chunks, for the mean & std of the dB levels), instead of the whole episode.
+        :param subtitles: the path to the .srt subtitle file.
+        :param episode_audio: the path to the episode's audio file.
+        :return: True if they're valid, False if they're not, or None if the sample is inconclusive (or the audio
+                 isn't a .wav file).
+        """
+        subs = srt_reader.read(subtitles)
+        if not self._has_enough_dashes(subs):
+            print("Subtitles don't have enough dashes. Dropping them.")
+            return False
+        if not episode_audio.endswith('.wav'):
+            return None
+
+        samples_per_second, wavdata = read(episode_audio, mmap=True)
+        cps = self.db_measurement_chunks_per_second
+        numchunks = int((len(wavdata) / samples_per_second) * cps)
+        # the windows of the peak & silence tests (2 chunks before to 5 chunks after) must be inside the audio.
+        subs = [sub for sub in subs if 2 <= int(sub.start * cps) and int(sub.end * cps) + 5 < numchunks]
+        if len(subs) < 2 * self.validation_sample_size or numchunks < self.validation_background_chunks:
+            return None
+
+        rng = random.Random(numchunks)
+        background = array(envelope.get_chunk_dbs(wavdata, samples_per_second, cps,
+                                                  rng.sample(range(numchunks), self.validation_background_chunks)))
+        background = background[~isinf(background)]
+        m, s = mean(background), std(background)
+
+        # measure the 8 chunks around the start & the end of every sampled subtitle.
+        sample = rng.sample(subs, self.validation_sample_size)
+        chunks = [int(t * cps) + i for sub in sample for t in (sub.start, sub.end) for i in range(-2, 6)]
+        windows = array(envelope.get_chunk_dbs(wavdata, samples_per_second, cps, chunks))
+        window_starts = arange(0, len(chunks), 16) + 2
+        scores = (0.6*self._are_peaks(window_starts, windows, m, s) +
+                  0.4*self._are_silences(window_starts + 8, windows, m, s))
+
+        estimate = scores.mean()
+        margin = self.validation_z * scores.std(ddof=1) / sqrt(len(scores))
+        print("sampled subtitle/audio sync measure is: %.4f (+-%.4f)" % (estimate, margin))
+        if estimate - margin > self.sync_threshold:
+            return True
+        if estimate + margin < self.sync_threshold:
+            print("Subtitles aren't in sync")
+            return False
+        return None
+
+    def _resync(self, subtitles, dbs):
+        """
+        Shifts & scales the times of subtitles that are out of sync, and rewrites them if that puts them in sync.
+        :param subtitles: the path to the .srt subtitle file.
+        :param dbs: an array of the dB audio levels.
+        :return: True if the subtitles were rewritten, False otherwise.
+        """
+        subs = srt_reader.read(subtitles)
+        if not self._has_enough_dashes(subs):
+            return False
+        time_shift, sync_measure = self._get_resynced_measure(subs, dbs)
+        if sync_measure < self.sync_threshold:
+            return False
+        srt_reader.write(self._shift(subs, *time_shift, dbs), subtitles)
+        return True
+
+    def _get_resynced_measure(self, subs, dbs):
+        """
+        :return: A tuple ((scale, offset), sync measure of the subtitles after shifting them).
+        """
+        scale, offset = self._estimate_time_shift(subs, dbs)
+        print("Resyncing subtitles: scale %.5f, offset %.2f seconds." % (scale, offset))
+        # subtitles that are shifted out of the audio count as misses.
+        return (scale, offset), self._get_sync_measure(self._shift(subs, scale, offset, dbs), dbs, total=len(subs))
+
+    def _shift(self, subs, scale, offset, dbs):
+        """
+        :return: The subtitles with their times mapped by t -> scale*t + offset. Subtitles that are shifted out of the
+                 audio are dropped.
+        """
+        max_start = (len(dbs) - 6) / self.db_measurement_chunks_per_second      # see _are_peaks()
+        shifted = [sub._replace(start=sub.start*scale + offset, end=sub.end*scale + offset) for sub in subs]
+        return [sub for sub in shifted if 0 <= sub.start < max_start]
+
+    def _estimate_time_shift(self, subs, dbs):
+        """
+        Estimates the linear time mapping (t -> scale*t + offset) that best aligns the subtitles with the audio. The
+        speech activity of the subtitles (1 while a subtitle is shown, 0 otherwise) is cross-correlated with the dB
+        levels for each of the frame rate conversion scales, which gives the scale & a global offset. Then the drift is
+        estimated from the offsets of the first & second halves of the subtitles, searched near the global offset.
+        :param subs: a list of SrtItem objects (see srt_reader).
+        :param dbs: an array of the audio's dB levels.
+        :return: A tuple (scale, offset), the offset is in seconds.
+        """
+        cps = self.db_measurement_chunks_per_second
+        dbs = array(dbs, dtype='float64')
+        levels = where(isinf(dbs), dbs[~isinf(dbs)].min(), dbs)
+        levels -= levels.mean()
+        max_lag = int(self.max_resync_offset * cps)
+
+        best = None
+        for scale in self.resync_scales:
+            lag, score = self._correlate(subs, levels, scale, 0, max_lag)
+            if best is None or score > best[2]:
+                best = (scale, lag, score)
+        scale, lag, _ = best
+
+        # fit a line through the offsets of the 2 halves, around their middle times.
+        middle = len(subs) // 2
+        points = []
+        for half in (subs[:middle], subs[middle:]):
+            if not half:
+                return scale, lag / cps
+            half_lag, _ = self._correlate(half, levels, scale, lag, int(self.max_resync_drift * cps))
+            points.append(((half[0].start + half[-1].end) / 2 * scale, half_lag / cps))
+        (t1, offset1), (t2, offset2) = points
+        if t2 - t1 <= 0:
+            return scale, lag / cps
+        drift = (offset2 - offset1) / (t2 - t1)
+        return scale * (1 + drift), offset1 - drift * t1
+
+    def _correlate(self, subs, levels, scale, center_lag, max_lag):
+        """
+        :return: A tuple (lag, score): the lag (in chunks, within max_lag of center_lag) in which the scaled speech
+                 activity of the subtitles correlates best with the levels, and the correlation.
+        """
+        cps = self.db_measurement_chunks_per_second
+        activity = zeros(len(levels) + 1)
+        starts = (array([sub.start for sub in subs]) * scale * cps).astype('int64').clip(0, len(levels))
+        ends = (array([sub.end for sub in subs]) * scale * cps).astype('int64').clip(0, len(levels))
+        add.at(activity, starts, 1)
+        add.at(activity, ends, -1)
+        activity = (cumsum(activity[:-1]) > 0).astype('float64')
+        activity -= activity.mean()
+
+        # correlation[len(levels) - 1 + lag] = sum(levels[i + lag] * activity[i])
+        correlation = correlate(levels, activity, mode='full', method='fft')
+        lags = arange(-len(levels) + 1, len(levels))
+        in_range = abs(lags - center_lag) <= max_lag
+        i = argmax(where(in_range, correlation, -float('inf')))
+        return int(lags[i]), correlation[i]
+
     @staticmethod
     def _has_enough_dashes(subs):
         """
         A common convention in movie subtitles, is that when the speech of 2 characters is covered by one subtitle, it is
         denoted by a dash. Some subtitles on the web do not have these dashes, which may compromise the integrity of our
         produced data, thus we must disqualify those dash-lacking subtitles..
-        :param sub: a list of pysrt Subtitles.
+        :param sub: a list of SrtItem objects (see srt_reader).
         :return: True if it has enough dashes, False otherwise.
         """
         min_dash_threshold = 1
@@ -177,79 +404,92 @@ class SubtitleGetter:
 
         return dashes >= min_dash_threshold
 
-    def _get_sync_measure(self, subs, dbs):
+    def _get_sync_measure(self, subs, dbs, total=None):
         """
         Checks if the subtitles match the audio.
-        :param subs: a list of pysrt Subtitles.
+        :param subs: a list of SrtItem objects (see srt_reader).
         :param dbs: an array of the audio's dB levels.
+        :param total: The number of subtitles to score against (default: len(subs)). Subtitles that aren't in 'subs'
+                      count as misses.
         :return: False if not in sync OR 'subtitles' file doesn't exist.
         """
+        total = len(subs) if total is None else total
+        if not subs or not total:
+            print("subtitle/audio sync measure is: 0 (no subtitles)")
+            return 0
         # count how many subtitle starting times match actual peaks in the audio.
-        dbs_without_infs = [dB for dB in dbs if not isinf(dB)]
+        dbs = array(dbs, dtype='float64')
+        dbs_without_infs = dbs[~isinf(dbs)]
         m, s = mean(dbs_without_infs), std(dbs_without_infs)
-        peaks = 0
-        silences = 0
-        for sub in subs:
-            if self._is_a_peak((sub.start.ordinal / 1000), dbs, m, s):
-                peaks += 1
-            if self._is_a_silence((sub.end.ordinal / 1000), dbs, m, s):
-                silences += 1
+        start_chunks = (array([sub.start for sub in subs]) * self.db_measurement_chunks_per_second).astype('int64')
+        end_chunks = (array([sub.end for sub in subs]) * self.db_measurement_chunks_per_second).astype('int64')
+        peaks = int(self._are_peaks(start_chunks, dbs, m, s).sum())
+        silences = int(self._are_silences(end_chunks, dbs, m, s).sum())
 
-        sync_measure = 0.6*(peaks / len(subs)) + 0.4*(silences / len(subs))
+        sync_measure = 0.6*(peaks / total) + 0.4*(silences / total)
         print("subtitle/audio sync measure is: %.4f" % sync_measure)
         return sync_measure
 
     def _get_audio_dbs(self, audio_file):
         """
-        :param audio_file: The path to the episode's audio file.
+        :param audio_file: The path to the episode's audio file (.wav), or to its saved envelope (.npz).
         :return: an array of calculated dB measurements for the audio file.
         """
-        samples_per_second, wavdata = read(audio_file, mmap=True)
-
-        # split audio to chunks to measure Db
-        numchunks = int((len(wavdata) / samples_per_second) * self.db_measurement_chunks_per_second)
-        chunks = array_split(wavdata, numchunks)
-        chunks = [array(chunk, dtype='float64') for chunk in chunks]      # to prevent integer overflow
-        dbs = [20*log10wrapper( mean(sqrt((chunk / 32767)**2)) ) for chunk in chunks]     # list of dB values for the chunks
+        return envelope.get_audio_dbs(audio_file, self.db_measurement_chunks_per_second)
 
-        return dbs
-
-    def _is_a_peak(self, sub_time, dbs, m, s):
+    @staticmethod
+    def _are_peaks(chunks, dbs, m, s):
         """
-        :param sub_time: in seconds
-        :param dbs: list of dB levels
+        A subtitle starts at a peak if, in the chunks from 2 before it to 5 after it, there is a silent chunk (below
+        m - s) that is followed by a talking chunk (at least m + s), and no silent chunk comes after them.
+        :param chunks: an array of chunk indices (negative indices count from the end, as in a list).
+        :param dbs: an array of dB levels
         :param m: mean
         :param s: standard deviation
-        :return: True if it's a peak, False otherwise.
+        :return: a boolean array, True for the chunks that are peaks.
         """
         silence_threshold = m - s
         talking_threshold = m + s
-        chunk_i = int(sub_time * self.db_measurement_chunks_per_second)
-
-        silence, possible_speech, peak = False, False, False
-        for i in range(-2, 6):
-            if dbs[chunk_i + i] < silence_threshold:
-                silence = True
-                possible_speech = False
-                peak = False
-            elif dbs[chunk_i + i] >= talking_threshold and silence == True:
-                silence = False
-                peak = False
-                possible_speech = True
-            if dbs[chunk_i + i] > silence_threshold and possible_speech:
-                peak = True
-        return peak
-
-    def _is_a_silence(self, sub_time, dbs, m, s):
-        chunk_i = int(sub_time * self.db_measurement_chunks_per_second)
+        offsets = arange(-2, 6)
+        windows = dbs[chunks[:, None] + offsets]
+
+        is_silent = windows < silence_threshold
+        has_silence = is_silent.any(axis=1)
+        last_silence = len(offsets) - 1 - argmax(is_silent[:, ::-1], axis=1)
+        # the first talking chunk after the last silence starts a possible speech, which peaks at any chunk from
+        # there on that is above the silence threshold.
+        is_speech_start = (windows >= talking_threshold) & (arange(len(offsets)) > last_silence[:, None])
+        speech_start = argmax(is_speech_start, axis=1)
+        is_above_silence = (windows > silence_threshold) & (arange(len(offsets)) >= speech_start[:, None])
+        return has_silence & is_speech_start.any(axis=1) & is_above_silence.any(axis=1)
+
+    def _are_silences(self, chunks, dbs, m, s):
+        """
+        :param chunks: an array of chunk indices (negative indices count from the end, as in a list).
+        :return: a boolean array, True for the chunks whose surrounding is silent on average.
+        """
         interval = int(self.db_measurement_chunks_per_second*0.2)
         silence_threshold = m - s
-        if mean(dbs[chunk_i-int(interval/2):chunk_i+interval]) < silence_threshold:
-            return True
-        else:
-            return False
+        starts, stops = chunks - int(interval/2), chunks + interval
+
+        # the windows are sliced as a list would be: negative starts count from the end, stops are clipped.
+        starts = where(starts < 0, maximum(starts + len(dbs), 0), starts)
+        stops = minimum(stops, len(dbs))
+        length = interval + int(interval/2)
+        is_whole = stops - starts == length
+
+        result = zeros(len(chunks), dtype=bool)
+        windows = dbs[starts[is_whole, None] + arange(length)]
+        result[is_whole] = windows.sum(axis=1) / length < silence_threshold
+        for i in flatnonzero(~is_whole).tolist():
+            result[i] = mean(dbs[starts[i]:stops[i]]) < silence_threshold    # an empty window's mean is nan
+        return result
 
 
 class SubtitlesNotInSyncException(Exception):
     pass
 
+
+class NoSubtitlesException(Exception):
+    pass
+
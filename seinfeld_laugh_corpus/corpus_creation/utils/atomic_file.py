@@ -0,0 +1,24 @@
+"""
+Writes files atomically: the content is written to a temporary file that then replaces the file, so concurrent readers
+(threads or processes) never see a partial file. Used by the on-disk caches.
+"""
+import os
+import threading
+
+
+def write(path, content):
+    """
+    :param path: The path of the file. Its folder is created if it doesn't exist.
+    :param content: bytes.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # unique per process & thread, so concurrent writers of the same file don't share a temporary file.
+    temp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,248 @@
+"""
+Calculates the dB envelope of an audio file: the audio is split to equal chunks and the dB level of each chunk is
+measured. The samples are read block by block from the memory-mapped .wav file, so memory stays bounded no matter how
+long the episode is.
+
+The envelope is calculated once per audio file, at a fine base resolution (BASE_CHUNKS_PER_SECOND), and saved next to
+it as a small .npz file, keyed by the file's fingerprint (see get_cache_path()). Coarser resolutions are derived from it
+by aggregation, so the different stages of the pipeline (and later re-runs) don't need to read the .wav file again.
+The boundaries of the aggregated chunks are those of get_dbs(), rounded to the nearest base chunk boundary.
+
+get_stream_envelopes() calculates the envelopes of the audio and of its laugh track in one pass over a .wav stream
+(e.g. ffmpeg's output), without writing any .wav file.
+"""
+import hashlib
+import os
+import struct
+
+import numpy as np
+from scipy.io.wavfile import read
+
+from utils.stage_cache import fingerprint_file
+from utils.utils import log10wrapper
+
+BLOCK_SIZE = 2**20                  # maximum number of samples (per channel) processed at once.
+BASE_CHUNKS_PER_SECOND = 200        # the resolution of the cached envelope.
+REDUCED_SAMPLES_PER_CHUNK = 20      # samples per base chunk in the 'reduced' audio profile.
+
+
+def get_audio_dbs(audio_file, chunks_per_second):
+    """
+    :param audio_file: The path to a 16 bit .wav file, or to a saved envelope (.npz, see save_envelope()).
+    :param chunks_per_second: chunks (to measure dB of) per second.
+    :return: a list of calculated dB measurements for the audio file.
+    """
+    if audio_file.endswith('.npz'):
+        return aggregate_dbs(load_envelope(audio_file), chunks_per_second)
+    if chunks_per_second > BASE_CHUNKS_PER_SECOND:
+        samples_per_second, wavdata = read(audio_file, mmap=True)
+        return get_dbs(wavdata, samples_per_second, chunks_per_second)
+
+    return aggregate_dbs(get_base_envelope(audio_file), chunks_per_second)
+
+
+def get_reduced_sample_rate(samples_per_chunk=REDUCED_SAMPLES_PER_CHUNK):
+    """
+    The envelopes are measured at (at most) BASE_CHUNKS_PER_SECOND, so the audio doesn't need a higher sample rate than
+    a few dozens of samples per base chunk. Resampling keeps the speech & laughter band (up to half of this rate).
+    :return: The sample rate of the 'reduced' audio profile.
+    """
+    return BASE_CHUNKS_PER_SECOND * samples_per_chunk
+
+
+def get_base_envelope(audio_file):
+    """
+    Loads the envelope of the audio file from the cache, or calculates (and caches) it.
+    :param audio_file: The path to a 16 bit .wav file.
+    :return: A dict with the keys 'sums' & 'counts' (arrays of the sum of the absolute sample values of every chunk,
+             and the number of sample values in it. There are BASE_CHUNKS_PER_SECOND chunks per second),
+             'samples_per_second' and 'samples' (the length of the audio).
+    """
+    cache_path = get_cache_path(audio_file)
+    if os.path.isfile(cache_path):
+        return load_envelope(cache_path)
+
+    samples_per_second, wavdata = read(audio_file, mmap=True)
+    numchunks = int((len(wavdata) / samples_per_second) * BASE_CHUNKS_PER_SECOND)
+    sums, counts = get_chunk_sums(wavdata, numchunks)
+    envelope = {'sums': sums, 'counts': counts, 'samples_per_second': samples_per_second, 'samples': len(wavdata)}
+    try:
+        save_envelope(envelope, cache_path)
+    except OSError as e:
+        print("Warning: could not save the audio envelope to '%s' (%s)." % (cache_path, str(e)))
+    return envelope
+
+
+def get_stream_envelopes(wav_stream, block_size=BLOCK_SIZE):
+    """
+    Calculates the envelopes of a stereo audio stream and of its laugh track in one pass. The laugh track is what
+    'sox gain -n' followed by 'sox oops' would produce: the audio is normalized to a peak of 0 dBFS, and each channel
+    becomes (L - R) / 2. Since the normalization gain is only known at the end of the stream, it is applied to the
+    laugh track's envelope instead of to the samples.
+    :param wav_stream: A binary file object of a 16 bit stereo .wav file (may be a pipe).
+    :param block_size: maximum number of samples (per channel) processed at once.
+    :return: A tuple of envelopes (audio, laugh track), as returned by get_base_envelope().
+    """
+    samples_per_second, channels = _read_wav_header(wav_stream)
+    if channels != 2:
+        raise ValueError("The laugh track can only be extracted from stereo audio (got %d channels)." % channels)
+
+    chunk_length = max(1, samples_per_second // BASE_CHUNKS_PER_SECOND)
+    block_length = chunk_length * max(1, block_size // chunk_length)
+    sums, laugh_sums, counts = [], [], []
+    samples, peak = 0, 0
+    while True:
+        data = wav_stream.read(block_length * channels * 2)
+        block = np.frombuffer(data[:len(data) - len(data) % (channels * 2)], dtype='<i2').reshape(-1, channels)
+        if not len(block):
+            break
+        samples += len(block)
+        block = block.astype('int64')
+        peak = max(peak, int(np.abs(block).max()))
+
+        # split the block to base chunks (only the last block of the stream may end with a shorter chunk)
+        chunk_starts = np.arange(0, len(block), chunk_length)
+        sums.append(np.add.reduceat(np.abs(block).sum(axis=1), chunk_starts))
+        laugh_sums.append(np.add.reduceat(np.abs(block[:, 0] - block[:, 1]), chunk_starts))
+        counts.append(np.diff(np.append(chunk_starts, len(block))))
+    if not samples:
+        raise ValueError("The audio stream is empty.")
+
+    counts = np.concatenate(counts)
+    gain = 32767 / peak if peak else 1
+    audio = {'sums': np.concatenate(sums), 'counts': counts * channels,
+             'samples_per_second': samples_per_second, 'samples': samples}
+    laugh_track = {'sums': np.concatenate(laugh_sums) * (gain / 2), 'counts': counts,
+                   'samples_per_second': samples_per_second, 'samples': samples}
+    return audio, laugh_track
+
+
+def _read_wav_header(wav_stream):
+    """
+    Reads the header of a 16 bit PCM .wav stream, up to the beginning of the samples.
+    :return: A tuple (samples per second, channels).
+    """
+    riff, _, wave = struct.unpack('<4sI4s', wav_stream.read(12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError("The audio stream is not in the .wav format.")
+    samples_per_second = channels = None
+    while True:
+        chunk_id, chunk_size = struct.unpack('<4sI', wav_stream.read(8))
+        if chunk_id == b'data':
+            break
+        chunk = wav_stream.read(chunk_size + chunk_size % 2)
+        if chunk_id == b'fmt ':
+            _, channels, samples_per_second, _, _, bits = struct.unpack('<HHIIHH', chunk[:16])
+            if bits != 16:
+                raise ValueError("Only 16 bit audio is supported (got %d bits)." % bits)
+    if samples_per_second is None:
+        raise ValueError("The audio stream has no format chunk.")
+    return samples_per_second, channels
+
+
+def save_envelope(envelope, path):
+    np.savez(path, **envelope)
+
+
+def load_envelope(path):
+    with np.load(path) as envelope:
+        return dict(envelope)
+
+
+def get_cache_path(audio_file):
+    """
+    :return: The path of the cached envelope of the audio file, keyed by the file's fingerprint (see
+             stage_cache.fingerprint_file()), so it's found without reading the whole file.
+    """
+    h = hashlib.sha1(("%d %s" % (BASE_CHUNKS_PER_SECOND, fingerprint_file(audio_file))).encode('utf-8'))
+    return "%s.%s.envelope.npz" % (audio_file.rsplit(".", 1)[0], h.hexdigest()[:16])
+
+
+def aggregate_dbs(envelope, chunks_per_second):
+    """
+    :param envelope: The output of get_base_envelope().
+    :param chunks_per_second: chunks (to measure dB of) per second.
+    :return: a list of dB measurements, as get_dbs() would return.
+    """
+    samples = int(envelope['samples'])
+    numchunks = int((samples / int(envelope['samples_per_second'])) * chunks_per_second)
+    q, r = divmod(samples, numchunks)
+    chunk_starts = np.arange(numchunks) * q + np.minimum(np.arange(numchunks), r)      # as in numpy.array_split
+
+    # assign each base chunk to the chunk that contains its middle
+    counts = envelope['counts']
+    channels = counts.sum() // samples
+    base_ends = np.cumsum(counts) / channels
+    base_middles = base_ends - counts / channels / 2
+    chunk_i = np.searchsorted(chunk_starts, base_middles, side='right') - 1
+
+    chunk_sums = np.bincount(chunk_i, weights=envelope['sums'], minlength=numchunks)
+    chunk_counts = np.bincount(chunk_i, weights=counts, minlength=numchunks)
+    means = (chunk_sums / 32767 / chunk_counts).tolist()
+    return [20*log10wrapper(m) for m in means]     # list of dB values for the chunks
+
+
+def get_dbs(wavdata, samples_per_second, chunks_per_second, block_size=BLOCK_SIZE):
+    """
+    The chunks are the same as those of numpy.array_split(wavdata, numchunks): the first (len % numchunks) chunks are
+    one sample longer than the rest.
+    :param wavdata: An array of 16 bit samples (may be memory-mapped), of shape (samples,) or (samples, channels).
+    :param samples_per_second: The sample rate.
+    :param chunks_per_second: chunks (to measure dB of) per second.
+    :param block_size: maximum number of samples (per channel) processed at once.
+    :return: a list of calculated dB measurements, one per chunk.
+    """
+    numchunks = int((len(wavdata) / samples_per_second) * chunks_per_second)
+    means = []
+    for block, n in _iter_blocks(wavdata, numchunks, block_size):
+        block = np.abs(block / 32767).reshape(n, -1)     # float64, to prevent integer overflow
+        means.extend(block.mean(axis=1).tolist())
+
+    return [20*log10wrapper(m) for m in means]     # list of dB values for the chunks
+
+
+def get_chunk_dbs(wavdata, samples_per_second, chunks_per_second, chunks):
+    """
+    Measures only some of the chunks of get_dbs(), e.g. to sample the audio without reading all of it.
+    :param wavdata: An array of 16 bit samples (may be memory-mapped), of shape (samples,) or (samples, channels).
+    :param samples_per_second: The sample rate.
+    :param chunks_per_second: chunks (to measure dB of) per second.
+    :param chunks: An iterable of chunk indices.
+    :return: a list of the dB measurements of the chunks, as get_dbs() would measure them.
+    """
+    numchunks = int((len(wavdata) / samples_per_second) * chunks_per_second)
+    q, r = divmod(len(wavdata), numchunks)
+    dbs = []
+    for i in chunks:
+        start = i * q + min(i, r)
+        chunk = wavdata[start:start + q + (i < r)]
+        dbs.append(20*log10wrapper(np.abs(chunk / 32767).mean()))
+    return dbs
+
+
+def get_chunk_sums(wavdata, numchunks, block_size=BLOCK_SIZE):
+    """
+    :param wavdata: An array of 16 bit samples (may be memory-mapped), of shape (samples,) or (samples, channels).
+    :param numchunks: Number of chunks, split as in get_dbs().
+    :param block_size: maximum number of samples (per channel) processed at once.
+    :return: A tuple (sums, counts) of int64 arrays: the sum of the absolute sample values in every chunk, and the
+             number of sample values in it.
+    """
+    sums, counts = [], []
+    for block, n in _iter_blocks(wavdata, numchunks, block_size):
+        block = np.abs(block.astype('int64')).reshape(n, -1)
+        sums.append(block.sum(axis=1))
+        counts.append(np.full(n, block.shape[1], dtype='int64'))
+    return np.concatenate(sums), np.concatenate(counts)
+
+
+def _iter_blocks(wavdata, numchunks, block_size):
+    """
+    Yields blocks of consecutive chunks of the same length, along with the number of chunks in each block.
+    """
+    q, r = divmod(len(wavdata), numchunks)
+    for first_sample, chunk_length, count in ((0, q + 1, r), (r * (q + 1), q, numchunks - r)):
+        chunks_per_block = max(1, block_size // max(chunk_length, 1))
+        for i in range(0, count, chunks_per_block):
+            n = min(chunks_per_block, count - i)
+            yield wavdata[first_sample + i * chunk_length:first_sample + (i + n) * chunk_length], n
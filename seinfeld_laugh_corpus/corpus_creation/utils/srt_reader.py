@@ -0,0 +1,91 @@
+"""
+A lightweight .srt reader. Subtitles are parsed in one pass into compact records with times in seconds.
+Parsed files are cached by path & modification time, so different stages of the pipeline that read the same file
+share one parse. write() writes the records back to an .srt file.
+"""
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+SrtItem = namedtuple('SrtItem', ["start", "end", "text"])    # start & end in seconds
+
+TIMESTAMPS = re.compile(r'(\d+)[:.,](\d+)[:.,](\d+)[:.,](\d+)\s*-->\s*(\d+)[:.,](\d+)[:.,](\d+)[:.,](\d+)')
+ENCODINGS = ('utf-8-sig', 'cp1252')     # tried in this order, the last one ignores decoding errors.
+
+
+def read(srt_path):
+    """
+    :param srt_path: Path to an .srt subtitle file.
+    :return: A tuple of SrtItem objects.
+    """
+    stat = os.stat(srt_path)
+    return _read(os.path.abspath(srt_path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=16)
+def _read(srt_path, mtime, size):
+    with open(srt_path, 'rb') as f:
+        content = f.read()
+    for encoding in ENCODINGS[:-1]:
+        try:
+            txt = content.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            pass
+    else:
+        txt = content.decode(ENCODINGS[-1], errors='ignore')
+    return tuple(stream(txt.splitlines()))
+
+
+def stream(lines):
+    """
+    Yields the subtitles as soon as they have been parsed. Malformed subtitles are skipped.
+    :param lines: An iterable of lines of an .srt file.
+    """
+    block = []
+    for line in lines:
+        line = line.rstrip()
+        if line.strip():
+            block.append(line)
+        elif block:
+            item = _parse_block(block)
+            if item:
+                yield item
+            block = []
+    if block:
+        item = _parse_block(block)
+        if item:
+            yield item
+
+
+def write(items, srt_path):
+    """
+    :param items: An iterable of SrtItem objects.
+    :param srt_path: Path of the .srt file to write (utf-8).
+    """
+    with open(srt_path, 'w', encoding='utf-8') as f:
+        for i, item in enumerate(items, 1):
+            f.write("%d\n%s --> %s\n%s\n\n" % (i, _format_time(item.start), _format_time(item.end), item.text))
+
+
+def _format_time(seconds):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return "%02d:%02d:%02d,%03d" % (hours, minutes, seconds, milliseconds)
+
+
+def _parse_block(block):
+    if len(block) < 2:
+        return None
+    if '-->' not in block[0]:
+        block = block[1:]   # index line
+    m = TIMESTAMPS.match(block[0].strip())
+    if not m:
+        return None
+    t = [int(n) for n in m.groups()]
+    start = ((t[0]*60 + t[1])*60 + t[2])*1000 + t[3]     # in milliseconds
+    end = ((t[4]*60 + t[5])*60 + t[6])*1000 + t[7]
+    return SrtItem(start=start / 1000, end=end / 1000, text='\n'.join(block[1:]))
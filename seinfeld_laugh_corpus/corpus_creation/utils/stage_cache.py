@@ -0,0 +1,123 @@
+"""
+A persistent cache of the outputs of the processing stages of an episode (see Processor).
+
+The outputs of a stage are stored under a key that is a hash of the stage's name, of its settings (including the
+version of its code, see get_code_version()) and of the contents of its inputs. The stages are wired as a DAG - the
+inputs of a stage are outputs of the stages before it - so when an episode is processed again, only the stages whose
+inputs, code or settings changed run again, and the outputs of the rest are copied from the cache.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+
+from config import STAGES_CACHE_PATH
+
+HASHED_BYTES = 2**16        # a fingerprint of a (big) file is a hash of its size and of this many bytes at each end.
+MANIFEST = 'manifest.json'
+
+
+def hash_file(path):
+    """
+    :return: The SHA-1 of the file's content.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def fingerprint_file(path):
+    """
+    A cheap substitute for hash_file() for video files, which are too big to read just to check if they've changed.
+    :return: A hash of the file's size and of its first & last HASHED_BYTES bytes.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.sha1(b"%d " % size)
+    with open(path, 'rb') as f:
+        h.update(f.read(HASHED_BYTES))
+        f.seek(max(size - HASHED_BYTES, 0))
+        h.update(f.read(HASHED_BYTES))
+    return h.hexdigest()
+
+
+def get_code_version(*objects):
+    """
+    :param objects: Modules and classes (for a class, the modules of its base classes are included as well).
+    :return: A hash of the source files of the modules, so the cached outputs of a stage expire when its code changes.
+    """
+    paths = set()
+    for obj in objects:
+        modules = [sys.modules.get(cls.__module__) for cls in obj.__mro__] if isinstance(obj, type) else [obj]
+        for module in modules:
+            path = getattr(module, '__file__', None)    # builtins have no source file
+            if path:
+                paths.add(os.path.abspath(path))
+
+    h = hashlib.sha1()
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha1(f.read()).digest())
+    return h.hexdigest()
+
+
+class StageCache:
+    def __init__(self, path=STAGES_CACHE_PATH):
+        self.path = path
+
+    @staticmethod
+    def get_key(stage, inputs):
+        """
+        :param stage: The stage's name.
+        :param inputs: A dict of the content hashes of the stage's inputs and of its settings (JSON serializable).
+        :return: The key of the stage's outputs.
+        """
+        return hashlib.sha1(json.dumps([stage, inputs], sort_keys=True).encode('utf-8')).hexdigest()
+
+    def load(self, stage, key, directory):
+        """
+        Copies the cached outputs of a stage to a directory (under the names they had when they were saved).
+        :return: A dict of the form {output name: (path, content hash)}, or None if the outputs aren't cached.
+        """
+        entry_path = os.path.join(self.path, stage, key)
+        try:
+            with open(os.path.join(entry_path, MANIFEST), encoding='utf-8') as f:
+                manifest = json.load(f)
+            outputs = {}
+            for name, output in manifest.items():
+                outputs[name] = (os.path.join(directory, output['filename']), output['sha1'])
+                shutil.copyfile(os.path.join(entry_path, name), outputs[name][0])
+            return outputs
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, stage, key, outputs, hashes=None):
+        """
+        :param outputs: A dict of the form {output name: (path, file name to restore it as)}.
+        :param hashes: A dict of the form {output name: content hash}, for outputs that aren't identified by a hash of
+                       the file that is cached (e.g. that is cached in place of them). By default, the files are hashed.
+        :return: A dict of the form {output name: content hash}.
+        """
+        hashes = dict(hashes or {})
+        for name, (path, _) in outputs.items():
+            if name not in hashes:
+                hashes[name] = hash_file(path)
+        entry_path = os.path.join(self.path, stage, key)
+        temp_path = "%s.%d.%d.tmp" % (entry_path, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(temp_path)
+            for name, (path, _) in outputs.items():
+                shutil.copyfile(path, os.path.join(temp_path, name))
+            manifest = {name: {'filename': filename, 'sha1': hashes[name]} for name, (_, filename) in outputs.items()}
+            with open(os.path.join(temp_path, MANIFEST), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            if os.path.isdir(entry_path):
+                shutil.rmtree(entry_path)
+            os.replace(temp_path, entry_path)
+        except OSError as e:
+            print("Warning: could not cache the outputs of the '%s' stage (%s)." % (stage, str(e)))
+            shutil.rmtree(temp_path, ignore_errors=True)
+        return hashes
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the corpus creation code is run from its own folder, and imports its modules by their names there (e.g. 'config').
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'seinfeld_laugh_corpus', 'corpus_creation'))
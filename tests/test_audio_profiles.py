@@ -0,0 +1,111 @@
+"""
+Compares the 'reduced' audio profile with the 'full' one on a synthetic clip: dialogue in both channels, and laughter
+that is louder in one of them (so it survives the laugh track's L - R). The 'reduced' audio is resampled as ffmpeg's
+'-ar' does it (low-passed below the new Nyquist frequency), and both are measured through the streamed envelopes.
+
+The bounds are what the 'reduced' profile may change in the decisions of the pipeline. An episode that is closer than
+them to the extractor's minimum_laughter_dB / minimum_standard_devation, or to the subtitles' sync_threshold, may be
+accepted by one profile and rejected by the other - which is why 'full' is the default.
+"""
+import contextlib
+import io
+import os
+
+import numpy
+import pytest
+from scipy.io import wavfile
+from scipy.signal import butter, sosfilt, resample_poly
+
+from laugh_times_extractor.laugh_times_extractor import LaughTimesExtractor
+from subtitle_getter.subtitle_getter import SubtitleGetter
+from utils import envelope, srt_reader
+
+RATE = 44100
+SECONDS = 300
+
+MAX_LAUGH_TIME_DRIFT = 2 / LaughTimesExtractor.db_measurement_chunks_per_second    # seconds
+MAX_LAUGHTER_DB_DELTA = 3           # the laughter's energy above the reduced Nyquist frequency (2kHz) is lost.
+MAX_STANDARD_DEVIATION_DELTA = 0.5  # dB
+MAX_SYNC_MEASURE_DELTA = 0.05
+
+
+def make_clip(seed=0):
+    """
+    :return: A tuple (16 bit stereo samples, subtitles of the dialogue).
+    """
+    rng = numpy.random.default_rng(seed)
+
+    def noise(length, low, high):
+        return sosfilt(butter(4, [low, high], 'bandpass', fs=RATE, output='sos'), rng.standard_normal(length))
+
+    length = RATE * SECONDS
+    speech, laughter, subs = numpy.zeros(length), numpy.zeros(length), []
+    t, lines = 2.0, 0
+    while t < SECONDS - 8:
+        duration = rng.uniform(1.5, 3)
+        start, end = int(t * RATE), int((t + duration) * RATE)
+        syllables = numpy.abs(numpy.sin(numpy.pi * 4 * numpy.arange(end - start) / RATE))
+        speech[start:end] = noise(end - start, 100, 3400) * rng.uniform(0.2, 0.4) * syllables
+        subs.append(srt_reader.SrtItem(start=t, end=t + duration, text="- Hi."))
+        t += duration + rng.uniform(0.6, 1.2)
+        lines += 1
+        if lines % 2 == 0:
+            start, end = int(t * RATE), int((t + 1.5) * RATE)
+            laughter[start:end] = noise(end - start, 300, 6000) * rng.uniform(0.2, 0.4) * numpy.hanning(end - start)
+            t += 2
+    stereo = numpy.stack([speech + laughter, speech - 0.2 * laughter], axis=1)
+    stereo += numpy.stack([noise(length, 50, 8000), noise(length, 50, 8000)], axis=1) * 0.001
+    return (stereo / numpy.abs(stereo).max() * 30000).astype('int16'), subs
+
+
+def measure(samples, rate, subs):
+    """
+    :return: A dict of the laugh times, the mean laughter volume & the standard deviation of the laugh track (as
+             LaughTimesExtractor verifies them), and the subtitles' sync measure.
+    """
+    wav = io.BytesIO()
+    wavfile.write(wav, rate, samples)
+    wav.seek(0)
+    audio, laugh_track = envelope.get_stream_envelopes(wav)
+
+    extractor = LaughTimesExtractor()
+    laugh_dbs = envelope.aggregate_dbs(laugh_track, extractor.db_measurement_chunks_per_second)
+    laughters = extractor._get_laughters(laugh_dbs)
+    subtitle_getter = SubtitleGetter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        sync_measure = subtitle_getter._get_sync_measure(
+            subs, envelope.aggregate_dbs(audio, subtitle_getter.db_measurement_chunks_per_second))
+    return {'laugh_times': [l.time for l in laughters], 'laughter_db': numpy.mean([l.vol for l in laughters]),
+            'std': numpy.std(laugh_dbs), 'sync_measure': sync_measure}
+
+
+@pytest.fixture(scope='module')
+def profiles():
+    samples, subs = make_clip()
+    reduced_rate = envelope.get_reduced_sample_rate()
+    reduced = numpy.clip(resample_poly(samples.astype('float64'), reduced_rate, RATE, axis=0), -32768, 32767)
+    return measure(samples, RATE, subs), measure(reduced.astype('int16'), reduced_rate, subs)
+
+
+def test_laugh_times(profiles):
+    full, reduced = profiles
+    assert len(full['laugh_times']) == len(reduced['laugh_times']) > 0
+    drift = numpy.abs(numpy.subtract(full['laugh_times'], reduced['laugh_times']))
+    assert drift.max() <= MAX_LAUGH_TIME_DRIFT + 1e-9
+
+
+def test_laugh_track_verification(profiles):
+    full, reduced = profiles
+    assert abs(full['laughter_db'] - reduced['laughter_db']) <= MAX_LAUGHTER_DB_DELTA
+    assert abs(full['std'] - reduced['std']) <= MAX_STANDARD_DEVIATION_DELTA
+    # the clip is a valid laugh track, by both profiles.
+    for profile in profiles:
+        assert profile['laughter_db'] > LaughTimesExtractor.minimum_laughter_dB
+        assert profile['std'] > LaughTimesExtractor.minimum_standard_devation
+
+
+def test_sync_measure(profiles):
+    full, reduced = profiles
+    assert abs(full['sync_measure'] - reduced['sync_measure']) <= MAX_SYNC_MEASURE_DELTA
+    for profile in profiles:
+        assert profile['sync_measure'] > SubtitleGetter.sync_threshold
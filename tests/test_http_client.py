@@ -0,0 +1,90 @@
+"""
+Tests the on-disk cache of the screenplay downloaders' http_client against a local stand-in of a screenplays site.
+"""
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from screenplay_downloader import http_client
+
+
+class PagesServer(ThreadingHTTPServer):
+    """
+    Serves a page with an ETag at every path, except for the paths in 'statuses', and records the requests (with their
+    If-None-Match header).
+    """
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), PagesHandler)
+        self.requests = []
+        self.statuses = {}      # {path: the status code of its responses}
+        self.lock = threading.Lock()
+
+    def url(self, name):
+        return "http://127.0.0.1:%d/%s" % (self.server_address[1], name)
+
+
+class PagesHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.path in server.statuses:
+            self.send_error(server.statuses[self.path])
+            return
+        etag = '"%s"' % self.path[1:]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = ("The page %s." % self.path[1:]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, 'SCREENPLAYS_CACHE_PATH', str(tmp_path))
+    monkeypatch.setattr(http_client, 'BACKOFF', 0)
+    server = PagesServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fresh_pages_are_served_from_the_cache(server):
+    assert http_client.get(server.url('a')) == b"The page a."
+    assert http_client.get(server.url('a')) == b"The page a."
+    assert server.requests == [('/a', None)]
+
+
+def test_stale_pages_are_revalidated(server, monkeypatch):
+    monkeypatch.setattr(http_client, 'SCREENPLAYS_FRESHNESS', -1)
+    http_client.get(server.url('a'))
+    assert http_client.get(server.url('a')) == b"The page a."
+    assert server.requests == [('/a', None), ('/a', '"a"')]
+
+
+def test_missing_pages_are_remembered(server):
+    server.statuses['/missing'] = 404
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            http_client.get(server.url('missing'))
+    assert server.requests == [('/missing', None)]
+
+
+def test_cached_page_is_used_when_the_server_fails(server, monkeypatch):
+    monkeypatch.setattr(http_client, 'SCREENPLAYS_FRESHNESS', -1)
+    http_client.get(server.url('a'))
+    server.statuses['/a'] = 500
+    assert http_client.get(server.url('a')) == b"The page a."
+    assert len(server.requests) == 1 + http_client.MAX_RETRIES + 1
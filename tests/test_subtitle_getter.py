@@ -0,0 +1,288 @@
+"""
+Tests the subtitle downloads & the opensubtitles searches of SubtitleGetter against local stand-ins of the opensubtitles
+XML-RPC API and of its download server.
+"""
+import gzip
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from xmlrpc.server import SimpleXMLRPCServer
+
+import numpy
+import pytest
+from pythonopensubtitles.settings import Settings
+
+from subtitle_getter import opensubtitles_session
+from subtitle_getter.subtitle_getter import SubtitleGetter
+from utils import srt_reader
+
+SRT = "1\n00:00:01,000 --> 00:00:02,000\n- Hello.\n\n2\n00:00:03,000 --> 00:00:04,000\n- Hi.\n"
+
+
+class DownloadServer(ThreadingHTTPServer):
+    """
+    Serves gzipped subtitles at /<name>, and records the requests. A path can be set to fail a few times with 503, or
+    to stall.
+    """
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), DownloadHandler)
+        self.requests = []
+        self.failures = {}      # {path: number of 503 responses before the subtitle is served}
+        self.stalled = set()
+        self.delay = 0
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    def url(self, name):
+        return "http://127.0.0.1:%d/%s" % (self.server_address[1], name)
+
+
+class DownloadHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if self.path in server.stalled:
+                time.sleep(1)
+                return
+            time.sleep(server.delay)
+            if server.failures.get(self.path, 0) > 0:
+                server.failures[self.path] -= 1
+                self.send_error(503)
+                return
+            body = gzip.compress(SRT.replace("Hello", self.path[1:]).encode('utf-8'))
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def download_server():
+    server = DownloadServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def api_server(monkeypatch, download_server):
+    """
+    A stand-in of the opensubtitles XML-RPC API. Its 'results' are {(season, episode): number of results}.
+    """
+    server = SimpleXMLRPCServer(('127.0.0.1', 0), logRequests=False, allow_none=True)
+    server.queries = []
+    server.results = {}
+
+    def search(token, queries):
+        query = queries[0]
+        server.queries.append(query)
+        data = [{'IDSubtitleFile': '%d%02d%d' % (season, episode, i),
+                 'SubFileName': 'S%02dE%02d-%d.srt' % (season, episode, i),
+                 'SeriesEpisode': str(episode),
+                 'SubDownloadLink': download_server.url('S%02dE%02d-%d' % (season, episode, i))}
+                for (season, episode), n in sorted(server.results.items()) for i in range(n)
+                if season == query['season'] and query.get('episode', episode) == episode]
+        return {'status': '200 OK', 'data': data}
+
+    server.register_function(lambda user, password, language, user_agent: {'status': '200 OK', 'token': 'token'},
+                             'LogIn')
+    server.register_function(search, 'SearchSubtitles')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(Settings, 'OPENSUBTITLES_SERVER', "http://127.0.0.1:%d/" % server.server_address[1])
+    monkeypatch.setattr(opensubtitles_session, '_session', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    # the caches are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def get_result(server, name, subtitle_file_id=None):
+    return {'IDSubtitleFile': subtitle_file_id or name, 'SubFileName': name + '.srt',
+            'SubDownloadLink': server.url(name)}
+
+
+def test_candidates_are_downloaded_concurrently(api_server, download_server, tmp_path, monkeypatch):
+    api_server.results = {(1, 2): 3}
+    download_server.delay = 0.3
+    # the last result is the best synced one
+    monkeypatch.setattr(SubtitleGetter, '_get_sync_measure',
+                        lambda self, subs, dbs: 0.5 if subs[0].text.endswith('-2.') else 0.2)
+    output = tmp_path / 'out.srt'
+
+    SubtitleGetter(show='Show', resync=False)._fetch_subtitles_from_opensubtitles('Show S01E02.mkv', [], str(output))
+
+    assert download_server.max_active == 3
+    assert len(download_server.requests) == 3
+    assert "S01E02-2." in output.read_text()
+
+
+def test_downloads_are_cached_by_subtitle_file_id(download_server):
+    getter = SubtitleGetter()
+    first = getter._download_subtitle(get_result(download_server, 'a', subtitle_file_id='1'))
+    # another link to the same subtitle file isn't downloaded again
+    second = getter._download_subtitle(get_result(download_server, 'b', subtitle_file_id='1'))
+    third = getter._download_subtitle(get_result(download_server, 'c', subtitle_file_id='2'))
+
+    assert first == second != third
+    assert download_server.requests == ['/a', '/c']
+    with open(first, encoding='utf-8') as f:
+        assert "- a." in f.read()
+
+
+def test_search_is_batched_per_season(api_server):
+    api_server.results = {(1, 1): 5, (1, 2): 6, (2, 1): 1}
+    getter = SubtitleGetter(show='Show')
+
+    first = getter._get_opensubtitles_search_results('Show S01E01.mkv')
+    second = getter._get_opensubtitles_search_results('Show S01E02.mkv')
+
+    assert [r['SubFileName'] for r in first] == ['S01E01-%d.srt' % i for i in range(5)]
+    assert len(second) == 6
+    assert api_server.queries == [{'query': 'Show', 'season': 1, 'sublanguageid': 'eng'}]
+
+    # an episode that the season's results don't cover is searched on its own
+    api_server.results[(1, 3)] = 1
+    third = getter._get_opensubtitles_search_results('Show S01E03.mkv')
+    assert [r['SubFileName'] for r in third] == ['S01E03-0.srt']
+    assert api_server.queries[1:] == [{'query': 'Show', 'episode': 3, 'season': 1, 'sublanguageid': 'eng'}]
+
+
+def test_episode_with_few_season_results_is_searched_on_its_own(api_server):
+    api_server.results = {(1, 1): 2}
+    getter = SubtitleGetter(show='Show')
+
+    results = getter._get_opensubtitles_search_results('Show S01E01.mkv')
+    getter._get_opensubtitles_search_results('Show S01E01.mkv')
+
+    assert [r['SubFileName'] for r in results] == ['S01E01-0.srt', 'S01E01-1.srt']
+    assert [q.get('episode') for q in api_server.queries] == [None, 1]
+
+
+def test_truncated_season_results_are_searched_per_episode(api_server):
+    api_server.results = {(1, 1): 6, (1, 2): 4}
+    getter = SubtitleGetter(show='Show')
+    getter.search_results_cap = 10
+
+    results = getter._get_opensubtitles_search_results('Show S01E01.mkv')
+
+    assert len(results) == 6
+    assert [q.get('episode') for q in api_server.queries] == [None, 1]
+
+
+def test_download_is_retried(download_server):
+    getter = SubtitleGetter()
+    getter.download_retry_interval = 0
+    download_server.failures['/a'] = 2
+
+    path = getter._download_subtitle(get_result(download_server, 'a'))
+
+    assert download_server.requests == ['/a'] * 3
+    with open(path, encoding='utf-8') as f:
+        assert "- a." in f.read()
+
+
+def test_download_gives_up(download_server):
+    getter = SubtitleGetter()
+    getter.download_retry_interval = 0
+    download_server.failures['/a'] = getter.download_retries + 1
+
+    with pytest.raises(Exception, match="503"):
+        getter._download_subtitle(get_result(download_server, 'a'))
+    assert len(download_server.requests) == getter.download_retries + 1
+
+
+def test_stalled_download_times_out(download_server):
+    getter = SubtitleGetter()
+    getter.download_retry_interval = 0
+    getter.download_timeout = 0.2
+    download_server.stalled.add('/a')
+
+    start = time.time()
+    with pytest.raises(Exception, match="timed out"):
+        getter._download_subtitle(get_result(download_server, 'a'))
+    assert time.time() - start < (getter.download_retries + 1) * 1
+
+
+def test_expired_search_results_are_searched_again(api_server):
+    api_server.results = {(1, 1): 5}
+    getter = SubtitleGetter(show='Show')
+    getter._get_opensubtitles_search_results('Show S01E01.mkv')
+    getter._get_opensubtitles_search_results('Show S01E01.mkv')
+    assert len(api_server.queries) == 1
+
+    getter.search_cache_lifetime = 0
+    api_server.results = {(1, 1): 6}
+    results = getter._get_opensubtitles_search_results('Show S01E01.mkv')
+
+    assert len(api_server.queries) == 2
+    assert len(results) == 6
+
+
+def test_search_gives_up(monkeypatch):
+    class FailingSession:
+        attempts = 0
+
+        def search(self, query):
+            self.attempts += 1
+            raise Exception("503 Service Unavailable")
+
+    session = FailingSession()
+    monkeypatch.setattr(opensubtitles_session, 'get_session', lambda: session)
+    getter = SubtitleGetter(show='Show')
+    getter.search_retry_interval = 0
+
+    with pytest.raises(Exception, match="503"):
+        getter._get_opensubtitles_search_results('Show S01E01.mkv')
+    assert session.attempts == getter.search_attempts
+
+
+def test_sync_measure_of_no_subtitles():
+    assert SubtitleGetter()._get_sync_measure([], [0.0] * 100) == 0
+
+
+def test_subtitles_shifted_out_of_the_audio_count_as_misses(monkeypatch):
+    getter = SubtitleGetter()
+    dbs = [0.0] * (60 * getter.db_measurement_chunks_per_second)
+    subs = [srt_reader.SrtItem(start=t, end=t + 1, text="- Hi.") for t in (10, 20, 30, 40)]
+    monkeypatch.setattr(getter, '_are_peaks', lambda chunks, *args: numpy.ones(len(chunks), dtype=bool))
+    monkeypatch.setattr(getter, '_are_silences', lambda chunks, *args: numpy.ones(len(chunks), dtype=bool))
+    # shifting by 35 seconds puts the last 2 subtitles after the end of the audio.
+    monkeypatch.setattr(getter, '_estimate_time_shift', lambda subs, dbs: (1, 35))
+
+    (scale, offset), sync_measure = getter._get_resynced_measure(subs, dbs)
+
+    assert len(getter._shift(subs, scale, offset, dbs)) == 2
+    assert sync_measure == pytest.approx(0.5)
+
+
+def test_video_without_subtitles_is_reported_as_such(monkeypatch, tmp_path, capsys):
+    getter = SubtitleGetter()
+    downloads = []
+    monkeypatch.setattr(getter, '_get_audio_dbs', lambda audio: [])
+    monkeypatch.setattr(getter, '_fetch_subtitles_from_opensubtitles',
+                        lambda video, dbs, output: downloads.append(output))
+
+    getter.get_subtitles('Show S01E01.mkv', 'S01E01.wav', str(tmp_path / 'S01E01.srt'), extract_subtitles=False)
+
+    assert downloads == [str(tmp_path / 'S01E01.srt')]
+    output = capsys.readouterr().out
+    assert "no text subtitles" in output and "ffmpeg" not in output